@@ -0,0 +1,111 @@
+"""
+Vectorized allele filtering shared by plotly_rewrite.py and
+scripts/plotting_rewrite.py.
+
+A locus is held as five aligned float arrays (allele, count, mean, lo, hi),
+with missing or 'NaN' values as NaN. filter_mask() applies the count,
+CI-bounds, absolute-CI and relative-CI rules to whole arrays at once. It
+accepts a single locus (1-D arrays) or a stacked batch of loci from
+stack_loci() (2-D arrays padded with NaN); filter_allele_dicts_batch()
+filters many loci that way in a single pass.
+"""
+import numpy as np
+
+
+def locus_arrays(dosage_dict, mean_dict, ci_dict):
+    """
+    Convert allele-keyed dicts into (allele, count, mean, lo, hi) arrays,
+    aligned with dosage_dict's key order.
+    """
+    keys = list(dosage_dict)
+    allele = np.array([float(k) for k in keys], dtype=float)
+    count = np.array([dosage_dict[k] for k in keys], dtype=float)
+    mean = np.array([mean_dict.get(k) for k in keys], dtype=float)
+    ci = [ci_dict.get(k) for k in keys]
+    lo = np.array([c[0] if c is not None and len(c) > 1 else None for c in ci], dtype=float)
+    hi = np.array([c[1] if c is not None and len(c) > 1 else None for c in ci], dtype=float)
+    return allele, count, mean, lo, hi
+
+
+def stack_loci(loci):
+    """
+    Stack per-locus array tuples into 2-D (n_loci, max_alleles) arrays,
+    padding short loci with NaN. Returns (allele, count, mean, lo, hi, lengths).
+    """
+    lengths = np.array([len(arrays[0]) for arrays in loci], dtype=int)
+    width = int(lengths.max()) if len(loci) else 0
+    stacked = np.full((5, len(loci), width), np.nan)
+    for i, arrays in enumerate(loci):
+        for j, column in enumerate(arrays):
+            stacked[j, i, : lengths[i]] = column
+    return (*stacked, lengths)
+
+
+def filter_mask(
+    count,
+    mean,
+    lo,
+    hi,
+    count_threshold=100,
+    lower_threshold=None,
+    upper_threshold=None,
+    max_ci_range=None,
+    max_relative_ci_range=None,
+):
+    """
+    Return a boolean mask of the alleles that pass every filter: count at
+    least count_threshold, no NaN in mean/lo/hi, CI within the optional
+    bounds, and CI width (absolute, and relative to the mean) within the
+    optional limits. NaN padding never passes.
+    """
+    keep = ~(count < count_threshold)
+    keep &= ~(np.isnan(lo) | np.isnan(hi) | np.isnan(mean))
+    if lower_threshold is not None:
+        keep &= ~(lo < lower_threshold)
+    if upper_threshold is not None:
+        keep &= ~(hi > upper_threshold)
+    width = hi - lo
+    if max_ci_range is not None:
+        keep &= ~(width > max_ci_range)
+    if max_relative_ci_range is not None:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            keep &= ~(width / mean > max_relative_ci_range)
+    return keep
+
+
+def filter_allele_dicts(dosage_dict, mean_dict, ci_dict, **thresholds):
+    """
+    Filter allele-keyed dicts with filter_mask(), returning new dicts that
+    keep the original keys and values of the passing alleles.
+    """
+    _, count, mean, lo, hi = locus_arrays(dosage_dict, mean_dict, ci_dict)
+    keep = filter_mask(count, mean, lo, hi, **thresholds)
+    kept = [k for k, ok in zip(dosage_dict, keep) if ok]
+    return (
+        {k: dosage_dict[k] for k in kept},
+        {k: mean_dict[k] for k in kept},
+        {k: ci_dict[k] for k in kept},
+    )
+
+
+def filter_allele_dicts_batch(loci, **thresholds):
+    """
+    filter_allele_dicts() for a list of (dosage_dict, mean_dict, ci_dict)
+    loci, evaluating one filter_mask() over the stacked arrays of all of
+    them. Returns the filtered dict triples in the same order.
+    """
+    if not loci:
+        return []
+    _, count, mean, lo, hi, lengths = stack_loci([locus_arrays(*locus) for locus in loci])
+    keep = filter_mask(count, mean, lo, hi, **thresholds)
+    filtered = []
+    for (dosage_dict, mean_dict, ci_dict), row, n in zip(loci, keep, lengths):
+        kept = [k for k, ok in zip(dosage_dict, row[:n]) if ok]
+        filtered.append(
+            (
+                {k: dosage_dict[k] for k in kept},
+                {k: mean_dict[k] for k in kept},
+                {k: ci_dict[k] for k in kept},
+            )
+        )
+    return filtered
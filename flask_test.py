@@ -1,48 +1,546 @@
 #!/usr/bin/env python3
 
-from flask import Flask, request, render_template
+from flask import Blueprint, Flask, Response, current_app, g, request, render_template, make_response
+from contextlib import contextmanager
+import gzip
+import hashlib
 import json
 import os
 import csv
-from plotly_rewrite import query_allele_data, filter_allele_data, generate_figure_plotly
+import threading
+import time
 
-app = Flask(__name__)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+from plotly_rewrite import (
+    DEFAULT_COUNT_THRESHOLD,
+    query_allele_data,
+    query_default_plot_json,
+    query_plot_series,
+    query_allele_data_batch,
+    series_from_dicts,
+    filter_allele_data,
+    generate_figure_plotly,
+    generate_faceted_figure_plotly,
+)
+from locus_db import (
+    REGION_SORTS,
+    SCHEMA_VERSION,
+    db_version,
+    get_read_pool,
+    get_schema_version,
+    iter_allele_series,
+    query_region,
+    read_connection,
+    set_read_trace_callback,
+    top_hits,
+)
+from response_cache import TTLCache
+import metrics
+
+bp = Blueprint("locus", __name__)
+# Count every statement run on the read pool, per request and in total.
+set_read_trace_callback(metrics.count_query)
 
 DB_PATH = "/Users/ciarareeve/senior_design/BENG187/locus_data.db"
 DUPLICATE_CSV_FILE = "duplicates.csv"
 
+# Rendered /test_locus pages, keyed on the request parameters and the DB file version.
+RESPONSE_CACHE_MAX_ENTRIES = 512
+RESPONSE_CACHE_TTL_SECONDS = 3600
+BROWSER_CACHE_MAX_AGE = 300
+
+# At most this many requests query SQLite and build figures at once; the rest
+# wait up to DB_WORK_TIMEOUT_SECONDS for a slot and then get a 503.
+DB_WORKERS = 8
+DB_WORK_TIMEOUT_SECONDS = 10
+
+
+class AppState:
+    """An app's DB work slots and response cache, kept in app.extensions["locus"] by create_app."""
+
+    def __init__(self, db_workers):
+        self.db_slots = threading.BoundedSemaphore(db_workers)
+        self.response_cache = TTLCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS)
+        self.db_version = None
+
+
+def app_state():
+    return current_app.extensions["locus"]
+
+
+def db_path():
+    return current_app.config["LOCUS_DB_PATH"]
+
+
+class ServerBusy(Exception):
+    pass
+
+
+@contextmanager
+def db_slot():
+    """Hold one of the app's LOCUS_DB_WORKERS slots while querying and plotting."""
+    slots = app_state().db_slots
+    if not slots.acquire(timeout=DB_WORK_TIMEOUT_SECONDS):
+        raise ServerBusy()
+    try:
+        yield
+    finally:
+        slots.release()
+
+
+@bp.app_errorhandler(ServerBusy)
+def server_busy(e):
+    return "Error: Server busy, try again shortly.", 503, {"Retry-After": "1"}
+
+
+def current_db_version():
+    """Return the DB version, dropping cached responses and pooled connections when it changes."""
+    state = app_state()
+    version = db_version(db_path())
+    if version != state.db_version:
+        state.response_cache.clear()
+        # The file may have been replaced, so don't keep reading through old handles.
+        get_read_pool(db_path()).reset()
+        state.db_version = version
+    return version
+
+
+def cached_response(body, etag):
+    """Wrap a cached page with its ETag and Cache-Control; answers If-None-Match with 304."""
+    response = make_response(body)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = BROWSER_CACHE_MAX_AGE
+    return response.make_conditional(request)
+
+
+def encode_json(obj):
+    """Serialize to compact UTF-8 JSON, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+# Payloads smaller than this are sent uncompressed.
+MIN_COMPRESS_BYTES = 512
+
+
+def negotiate_encoding(size):
+    """Pick br (if the brotli module is installed) or gzip from Accept-Encoding."""
+    if size < MIN_COMPRESS_BYTES:
+        return None
+    if brotli is not None and "br" in request.accept_encodings:
+        return "br"
+    if "gzip" in request.accept_encodings:
+        return "gzip"
+    return None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    return data
+
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_start = metrics.start_request()
+
+
+@bp.after_app_request
+def record_request_metrics(response):
+    """
+    Report the request's stage timings as Server-Timing and record its
+    latency and SQL statement count (for a streamed response, once the
+    stream has been sent).
+    """
+    # Label by view name, without the blueprint prefix.
+    endpoint = request.endpoint.rpartition(".")[2] if request.endpoint else "unmatched"
+    start = g.get("request_start")
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        metrics.REQUEST_LATENCY.observe(endpoint, elapsed)
+        response.headers["Server-Timing"] = metrics.server_timing(metrics.request_stages(), elapsed)
+
+        def record_queries():
+            metrics.QUERIES_PER_REQUEST.observe(endpoint, metrics.request_queries())
+
+        if response.is_streamed:
+            response.call_on_close(record_queries)
+        else:
+            record_queries()
+    metrics.RESPONSES.inc(response.status_code)
+    return response
+
+
 # ============================
 # 🚀 FLASK ROUTE
 # ============================
-@app.route('/test_locus')
+@bp.route('/test_locus')
 def test_locus():
     repeat_id = request.args.get("repeat_id")
 
-    count_threshold = request.args.get("count_threshold", default=100, type=float)
+    count_threshold = request.args.get("count_threshold", default=DEFAULT_COUNT_THRESHOLD, type=float)
     max_ci_range = request.args.get("max_ci_range", default=None, type=float)
     max_relative_ci_range = request.args.get("max_relative_ci_range", default=None, type=float)
 
     if not repeat_id:
         return "Error: Missing required parameter 'repeat_id'.", 400
 
-    # Use the existing function from plotly_rewrite.py
-    dosage_dict, mean_dict, ci_dict = query_allele_data(DB_PATH, repeat_id)
+    cache_key = (repeat_id, count_threshold, max_ci_range, max_relative_ci_range, current_db_version())
+    cached = app_state().response_cache.get(cache_key)
+    if cached is not None:
+        return cached_response(*cached)
+
+    with db_slot():
+        # Default thresholds are served from the precomputed plot when there is one.
+        if count_threshold == DEFAULT_COUNT_THRESHOLD and max_ci_range is None and max_relative_ci_range is None:
+            gwas_plot_json = query_default_plot_json(db_path(), repeat_id)
+            if gwas_plot_json is not None:
+                return render_cached_page(cache_key, gwas_plot_json, repeat_id)
+
+        # Use the existing function from plotly_rewrite.py
+        dosage_dict, mean_dict, ci_dict = query_allele_data(db_path(), repeat_id)
+
+        if not dosage_dict:
+            return f"No GWAS trait association data found for repeat_id {repeat_id}.", 404
+
+        dosage_dict, mean_dict, ci_dict = filter_allele_data(
+            dosage_dict, mean_dict, ci_dict, count_threshold, max_ci_range, max_relative_ci_range
+        )
+
+        fig = generate_figure_plotly(dosage_dict, mean_dict, ci_dict)
+
+        if fig is None:
+            return "Error: Failed to generate plot.", 500
+
+        with metrics.stage("serialize"):
+            gwas_plot_json = fig.to_json()
+        return render_cached_page(cache_key, gwas_plot_json, repeat_id)
+
+
+@bp.route('/test_locus_phenotypes')
+def test_locus_phenotypes():
+    """
+    Every phenotype associated with one or more repeat_ids (comma-separated),
+    rendered as faceted subplots from a single batched query.
+    """
+    repeat_ids = [r for r in request.args.get("repeat_id", "").split(",") if r]
+
+    count_threshold = request.args.get("count_threshold", default=DEFAULT_COUNT_THRESHOLD, type=float)
+    max_ci_range = request.args.get("max_ci_range", default=None, type=float)
+    max_relative_ci_range = request.args.get("max_relative_ci_range", default=None, type=float)
+
+    if not repeat_ids:
+        return "Error: Missing required parameter 'repeat_id'.", 400
+
+    cache_key = ("phenotypes", tuple(repeat_ids), count_threshold, max_ci_range, max_relative_ci_range, current_db_version())
+    cached = app_state().response_cache.get(cache_key)
+    if cached is not None:
+        return cached_response(*cached)
+
+    with db_slot():
+        by_repeat_id = query_allele_data_batch(db_path(), repeat_ids)
+        if not by_repeat_id:
+            return f"No GWAS trait association data found for repeat_id {', '.join(repeat_ids)}.", 404
+
+        facets = []
+        for repeat_id in repeat_ids:
+            for phenotype, dosage_dict, mean_dict, ci_dict in by_repeat_id.get(repeat_id, []):
+                title = phenotype if len(repeat_ids) == 1 else f"{repeat_id}: {phenotype}"
+                facets.append((title, *filter_allele_data(
+                    dosage_dict, mean_dict, ci_dict, count_threshold, max_ci_range, max_relative_ci_range
+                )))
+
+        fig = generate_faceted_figure_plotly(facets)
+
+        if fig is None:
+            return "Error: Failed to generate plot.", 500
+
+        with metrics.stage("serialize"):
+            gwas_plot_json = fig.to_json()
+        return render_cached_page(cache_key, gwas_plot_json, ", ".join(repeat_ids))
+
+
+@bp.route('/api/locus/<repeat_id>')
+def api_locus(repeat_id):
+    """
+    Compact plot data for every phenotype of repeat_id:
+    {"repeat_id": ..., "loci": [{"phenotype", "x", "mean", "err_plus", "err_minus"}, ...]}
+    The figure itself is assembled client-side (see templates/locus_lean.html).
+    """
+    count_threshold = request.args.get("count_threshold", default=DEFAULT_COUNT_THRESHOLD, type=float)
+    max_ci_range = request.args.get("max_ci_range", default=None, type=float)
+    max_relative_ci_range = request.args.get("max_relative_ci_range", default=None, type=float)
+
+    cache_key = ("api", repeat_id, count_threshold, max_ci_range, max_relative_ci_range, current_db_version())
+    cached = app_state().response_cache.get(cache_key)
+    if cached is None:
+        with db_slot():
+            series_by_phenotype = query_plot_series(
+                db_path(), repeat_id, count_threshold, max_ci_range, max_relative_ci_range
+            )
+        loci = [{"phenotype": phenotype, **plot_data(series)} for phenotype, series in series_by_phenotype]
+        if not loci:
+            return {"error": f"No GWAS trait association data found for repeat_id {repeat_id}."}, 404
+        cached = cache_json(cache_key, {"repeat_id": repeat_id, "loci": loci})
+    return json_response(cached)
+
+
+REGION_MAX_LIMIT = 1000
+
+
+@bp.route('/api/region')
+def api_region():
+    """
+    Loci in a genomic region with their lead p-values, one per position:
+    /api/region?region=chr11:47,200,000-47,400,000&sort=p_value&limit=100&offset=0
+    (or chrom=, start=, end=). sort is "pos" (default) or "p_value".
+    """
+    region = request.args.get("region")
+    if region:
+        try:
+            chrom, span = region.replace(",", "").split(":")
+            start, end = (int(x) for x in span.split("-"))
+        except ValueError:
+            return {"error": f"Could not parse region '{region}'; expected chrom:start-end."}, 400
+    else:
+        chrom = request.args.get("chrom")
+        start = request.args.get("start", type=int)
+        end = request.args.get("end", type=int)
+        if not chrom or start is None or end is None:
+            return {"error": "Missing required parameter 'region' (or 'chrom', 'start' and 'end')."}, 400
+    if not chrom.startswith("chr"):
+        chrom = f"chr{chrom}"
+    sort = request.args.get("sort", "pos")
+    if sort not in REGION_SORTS:
+        return {"error": f"'sort' must be one of {', '.join(REGION_SORTS)}."}, 400
+    limit = min(max(request.args.get("limit", default=100, type=int), 1), REGION_MAX_LIMIT)
+    offset = max(request.args.get("offset", default=0, type=int), 0)
+
+    cache_key = ("region", chrom, start, end, sort, limit, offset, current_db_version())
+    cached = app_state().response_cache.get(cache_key)
+    if cached is None:
+        with db_slot(), metrics.stage("sqlite"), read_connection(db_path()) as conn:
+            total, loci = query_region(conn, chrom, start, end, sort, limit, offset)
+        cached = cache_json(cache_key, {
+            "chrom": chrom,
+            "start": start,
+            "end": end,
+            "sort": sort,
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            "loci": loci,
+        })
+    return json_response(cached)
+
+
+TOP_HITS_MAX_K = 1000
+
+
+@bp.route('/api/top_hits')
+def api_top_hits():
+    """
+    The k strongest loci (smallest p-value) per phenotype:
+    /api/top_hits?k=10&phenotype=glucose,calcium (every phenotype if omitted).
+    """
+    k = min(max(request.args.get("k", default=10, type=int), 1), TOP_HITS_MAX_K)
+    phenotypes = [p for p in request.args.get("phenotype", "").split(",") if p] or None
+
+    cache_key = ("top_hits", k, tuple(phenotypes or ()), current_db_version())
+    cached = app_state().response_cache.get(cache_key)
+    if cached is None:
+        with db_slot(), metrics.stage("sqlite"), read_connection(db_path()) as conn:
+            hits = top_hits(conn, k, phenotypes)
+        cached = cache_json(cache_key, {"k": k, "phenotypes": hits})
+    return json_response(cached)
+
+
+def cache_json(cache_key, obj):
+    """Encode obj and cache it as (payload, etag, compressed variants) under cache_key."""
+    with metrics.stage("serialize"):
+        payload = encode_json(obj)
+    cached = (payload, hashlib.sha1(payload).hexdigest(), {})
+    app_state().response_cache.put(cache_key, cached)
+    return cached
+
+
+def json_response(cached):
+    """Send a cache_json() entry, compressed per Accept-Encoding (compressed variants are cached too)."""
+    payload, etag, compressed = cached
+    encoding = negotiate_encoding(len(payload))
+    if encoding is not None and encoding not in compressed:
+        compressed[encoding] = compress(payload, encoding)
+
+    response = cached_response(compressed.get(encoding, payload), f"{etag}-{encoding}" if encoding else etag)
+    response.mimetype = "application/json"
+    response.vary.add("Accept-Encoding")
+    if encoding is not None and response.status_code == 200:
+        response.content_encoding = encoding
+    return response
+
+
+# Upper bound on repeat_ids per /api/loci request (each is one SQL parameter).
+MAX_BATCH_REPEAT_IDS = 5000
+
+
+@bp.route('/api/loci', methods=['POST'])
+def api_loci():
+    """
+    Plot data for many repeat_ids in one round trip. The JSON body is
+    {"repeat_ids": [...], "phenotype": optional, "count_threshold": optional,
+    "max_ci_range": optional, "max_relative_ci_range": optional}.
+    Every locus is read in a single query and streamed back as NDJSON, one
+    {"repeat_id", "phenotype", "chrom", "pos", "x", "mean", "err_plus", "err_minus"}
+    line per locus, followed by {"missing": [...]} if any repeat_ids had no data.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("repeat_ids"), list):
+        return {"error": "Expected a JSON object with a 'repeat_ids' list."}, 400
+    repeat_ids = list(dict.fromkeys(str(r) for r in body["repeat_ids"]))
+    if not repeat_ids:
+        return {"error": "'repeat_ids' is empty."}, 400
+    if len(repeat_ids) > MAX_BATCH_REPEAT_IDS:
+        return {"error": f"At most {MAX_BATCH_REPEAT_IDS} repeat_ids per request."}, 400
+    phenotype = body.get("phenotype")
+    try:
+        count_threshold = float(body.get("count_threshold", DEFAULT_COUNT_THRESHOLD))
+        max_ci_range = body.get("max_ci_range")
+        max_ci_range = float(max_ci_range) if max_ci_range is not None else None
+        max_relative_ci_range = body.get("max_relative_ci_range")
+        max_relative_ci_range = float(max_relative_ci_range) if max_relative_ci_range is not None else None
+    except (TypeError, ValueError):
+        return {"error": "Thresholds must be numbers."}, 400
+
+    # The slot is held until the stream has been sent (or the client went away).
+    slots = app_state().db_slots
+    if not slots.acquire(timeout=DB_WORK_TIMEOUT_SECONDS):
+        raise ServerBusy()
+    path = db_path()
+
+    def generate():
+        found = set()
+        with read_connection(path) as conn:
+            for locus, dosage_dict, mean_dict, ci_dict in iter_allele_series(
+                conn, phenotype=phenotype, repeat_ids=repeat_ids
+            ):
+                found.add(locus["repeat_id"])
+                series = series_from_dicts(*filter_allele_data(
+                    dosage_dict, mean_dict, ci_dict, count_threshold, max_ci_range, max_relative_ci_range
+                ))
+                yield encode_json({
+                    "repeat_id": locus["repeat_id"],
+                    "phenotype": locus["phenotype"],
+                    "chrom": locus["chrom"],
+                    "pos": locus["pos"],
+                    **plot_data(series),
+                }) + b"\n"
+        missing = [r for r in repeat_ids if r not in found]
+        if missing:
+            yield encode_json({"missing": missing}) + b"\n"
+
+    response = Response(generate(), mimetype="application/x-ndjson")
+    response.call_on_close(slots.release)
+    return response
+
+
+@bp.route('/locus/<repeat_id>')
+def locus_page(repeat_id):
+    """Page that fetches /api/locus/<repeat_id> and draws the plots in the browser."""
+    return render_template("locus_lean.html", repeat_id=repeat_id)
+
+
+def plot_data(series):
+    """Compact plot data for one series: x, mean and the error bar lengths either side."""
+    mean = series["mean"]
+    return {
+        "x": series["x"],
+        "mean": mean,
+        "err_plus": [hi - m for hi, m in zip(series["ci_high"], mean)],
+        "err_minus": [m - lo for lo, m in zip(series["ci_low"], mean)],
+    }
+
+
+def render_cached_page(cache_key, gwas_plot_json, repeat_id):
+    """Render the plot page for a Plotly JSON figure, cache it under cache_key and return it."""
+    with metrics.stage("render"):
+        body = render_template("flask_html_test.html", gwas_plot_json=gwas_plot_json, repeat_id=repeat_id)
+    etag = hashlib.sha1(body.encode("utf-8")).hexdigest()
+    app_state().response_cache.put(cache_key, (body, etag))
+    return cached_response(body, etag)
+
+
+@bp.route('/healthz')
+def healthz():
+    """Liveness: the process is up and answering requests."""
+    return {"status": "ok"}
+
+
+@bp.route('/readyz')
+def readyz():
+    """Readiness: the database opens read-only and is at the current schema version."""
+    try:
+        with read_connection(db_path()) as conn:
+            version = get_schema_version(conn)
+    except Exception as e:
+        return {"status": "unavailable", "error": str(e)}, 503
+    if version != SCHEMA_VERSION:
+        return {"status": "unavailable", "error": f"schema version {version}, expected {SCHEMA_VERSION}"}, 503
+    return {"status": "ready", "schema_version": version}
 
-    if not dosage_dict:
-        return f"No GWAS trait association data found for repeat_id {repeat_id}.", 404
 
-    dosage_dict, mean_dict, ci_dict = filter_allele_data(
-        dosage_dict, mean_dict, ci_dict, count_threshold, max_ci_range, max_relative_ci_range
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint: latency histograms, response cache and DB query counters for this process."""
+    response_cache = app_state().response_cache
+    lookups = response_cache.hits + response_cache.misses
+    body = metrics.render(
+        counters=[
+            ("locus_response_cache_hits_total", "Response cache hits.", response_cache.hits),
+            ("locus_response_cache_misses_total", "Response cache misses.", response_cache.misses),
+        ],
+        gauges=[
+            ("locus_response_cache_entries", "Responses currently cached.", len(response_cache)),
+            (
+                "locus_response_cache_hit_ratio",
+                "Fraction of response cache lookups that hit since startup.",
+                response_cache.hits / lookups if lookups else 0.0,
+            ),
+        ],
     )
+    return body, 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
 
-    fig = generate_figure_plotly(dosage_dict, mean_dict, ci_dict)
 
-    if fig is None:
-        return "Error: Failed to generate plot.", 500
+def create_app(db_path=None, db_workers=None):
+    """
+    WSGI app factory, e.g. `gunicorn "flask_test:create_app()"` (see serve.py).
+    db_path and db_workers fall back to the LOCUS_DB_PATH and LOCUS_DB_WORKERS
+    environment variables, then to DB_PATH and DB_WORKERS. Each call returns a
+    new app with its own config, DB work slots and response cache.
+    """
+    app = Flask(__name__)
+    app.config["LOCUS_DB_PATH"] = db_path or os.environ.get("LOCUS_DB_PATH", DB_PATH)
+    app.config["LOCUS_DB_WORKERS"] = db_workers or int(os.environ.get("LOCUS_DB_WORKERS", DB_WORKERS))
+    app.extensions["locus"] = AppState(app.config["LOCUS_DB_WORKERS"])
+    app.register_blueprint(bp)
+    # Keep a warm pooled connection for every slot.
+    get_read_pool(app.config["LOCUS_DB_PATH"]).max_idle = app.config["LOCUS_DB_WORKERS"]
+    return app
 
-    gwas_plot_json = fig.to_json()
 
-    return render_template("flask_html_test.html", gwas_plot_json=gwas_plot_json, repeat_id=repeat_id)
+# Default app for `flask run`, `python flask_test.py` and render_template users.
+app = create_app()
 
 # ============================
 # 🚀 RUN FLASK SERVER
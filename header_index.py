@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Persistent header index for a directory of locus files.
+
+The index is a small SQLite sidecar holding, for every file below the
+directory, its size, mtime, chrom, pos, motif and header columns. Entries
+are re-read only when a file's size or mtime changes, so tools that only
+need this metadata (scripts/find_traits.py, helpers/scan_blessed_set.py,
+scripts/import_to_db.py) can answer repeated searches without reopening
+every file.
+"""
+import argparse
+import csv
+import os
+import sqlite3
+
+import run_stats
+
+
+DEFAULT_INDEX_NAME = ".locus_header_index.db"
+
+
+def default_index_path(directory):
+    return os.path.join(directory, DEFAULT_INDEX_NAME)
+
+
+def read_header(file_path):
+    """
+    Read the header and first data row of a tab-delimited locus file.
+    Returns (columns, chrom, pos, motif); chrom, pos and motif are None if
+    the file has no data row or lacks those columns.
+    """
+    with open(file_path, "r", newline="", errors="replace") as f:
+        reader = csv.reader(f, delimiter="\t")
+        columns = next(reader, None) or []
+        row = next(reader, None)
+        run_stats.add_bytes(f.buffer.raw.tell())
+    if row is None:
+        return columns, None, None, None
+    values = dict(zip(columns, row))
+    try:
+        pos = int(values["pos"])
+    except (KeyError, ValueError):
+        pos = None
+    return columns, values.get("chrom"), pos, values.get("motif")
+
+
+def _create_tables(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS file_headers (
+            relpath TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER,
+            chrom TEXT,
+            pos INTEGER,
+            motif TEXT,
+            columns TEXT
+        );
+    """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_file_headers_chrom_pos ON file_headers (chrom, pos);"
+    )
+
+
+def _walk_files(directory, index_path):
+    """Yield (relpath, stat) for every regular file below directory."""
+    skip = {os.path.abspath(p) for p in (index_path, index_path + "-journal")}
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file() and os.path.abspath(entry.path) not in skip:
+                    yield os.path.relpath(entry.path, directory), entry.stat()
+
+
+def update_index(directory, index_path=None):
+    """
+    Bring the index for directory up to date and return an open connection.
+    Only new files and files whose size or mtime changed are re-read;
+    entries for deleted files are dropped.
+    """
+    index_path = index_path or default_index_path(directory)
+    conn = sqlite3.connect(index_path)
+    _create_tables(conn)
+
+    known = {
+        r[0]: (r[1], r[2])
+        for r in conn.execute("SELECT relpath, size, mtime_ns FROM file_headers")
+    }
+    changed = []
+    seen = set()
+    for relpath, stat in _walk_files(directory, index_path):
+        seen.add(relpath)
+        if known.get(relpath) == (stat.st_size, stat.st_mtime_ns):
+            continue
+        try:
+            columns, chrom, pos, motif = read_header(os.path.join(directory, relpath))
+        except OSError as e:
+            print(f"[ERROR] Could not read {relpath}: {e}")
+            continue
+        changed.append(
+            (relpath, stat.st_size, stat.st_mtime_ns, chrom, pos, motif, "\t".join(columns))
+        )
+
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO file_headers VALUES (?, ?, ?, ?, ?, ?, ?)", changed
+        )
+        conn.executemany(
+            "DELETE FROM file_headers WHERE relpath = ?",
+            [(p,) for p in known if p not in seen],
+        )
+    return conn
+
+
+def load_headers(directory, index_path=None):
+    """
+    Refresh the index and return {relpath: (chrom, pos, motif, columns)}.
+    """
+    conn = update_index(directory, index_path)
+    rows = conn.execute("SELECT relpath, chrom, pos, motif, columns FROM file_headers")
+    headers = {
+        r[0]: (r[1], r[2], r[3], r[4].split("\t") if r[4] else []) for r in rows
+    }
+    conn.close()
+    return headers
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build or refresh the header index for a directory of locus files"
+    )
+    parser.add_argument(
+        "--directory", required=True, help="Directory of .tab locus files to index"
+    )
+    parser.add_argument(
+        "--index-path",
+        default=None,
+        help=f"Path of the index file (default: {{directory}}/{DEFAULT_INDEX_NAME})",
+    )
+    args = parser.parse_args()
+
+    conn = update_index(args.directory, args.index_path)
+    n_files, n_loci = conn.execute(
+        "SELECT COUNT(*), COUNT(pos) FROM file_headers"
+    ).fetchone()
+    conn.close()
+    print(f"Indexed {n_files} files ({n_loci} with chrom/pos) under {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
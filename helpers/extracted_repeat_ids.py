@@ -1,36 +1,164 @@
+import argparse
+import os
 import re
 import csv
-from bs4 import BeautifulSoup
+import sqlite3
+import sys
+from html.parser import HTMLParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates"))
+import update_db_repeat_ids
 
 # File paths
 INPUT_HTML = "/Users/ciarareeve/senior_design/helpers/gwas_hg38.html"  # Replace with actual HTML file path
 OUTPUT_CSV = "output_repeat_ids.csv"
 
-# Read the HTML file
-with open(INPUT_HTML, "r", encoding="utf-8") as f:
-    soup = BeautifulSoup(f, "html.parser")
-
-# Find all <a> tags with href containing repeat_id and hg38
-rows = []
-for link in soup.find_all("a", href=True):
-    href = link["href"]
-    text = link.get_text(strip=True)  # Extract visible text (e.g., "10:44390336-44390351")
-
-    # Match only hg38 links with repeat_id
-    match = re.search(r"repeat_id=(\d+)&genome=hg38", href)
-    if match:
-        repeat_id = match.group(1)
-        
-        # Ensure the text follows the expected chrom:start-end format
-        coord_match = re.match(r"(\d+|X|Y):(\d+)-(\d+)", text)
-        if coord_match:
-            chrom, start, end = coord_match.groups()
-            rows.append([repeat_id, chrom, start, end])
-
-# Save to CSV
-with open(OUTPUT_CSV, "w", newline="") as f:
-    writer = csv.writer(f)
-    writer.writerow(["repeat_id", "chrom", "start", "end"])
-    writer.writerows(rows)
-
-print(f"Extracted {len(rows)} entries and saved to {OUTPUT_CSV}")
+# Match only hg38 links with repeat_id, whose text follows the chrom:start-end format
+HREF_PATTERN = re.compile(r"repeat_id=(\d+)&genome=hg38")
+COORD_PATTERN = re.compile(r"(\d+|X|Y):(\d+)-(\d+)")
+
+READ_CHUNK_CHARS = 1 << 20
+
+
+class RepeatLinkParser(HTMLParser):
+    """
+    Incremental <a> tag scanner. Feed it text in chunks; completed rows
+    collect in self.rows and are drained by the caller, so only the
+    current link is ever held in memory.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self._href = None
+        self._text = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            self._href = dict(attrs).get("href")
+            self._text = []
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text.append(data.strip())  # Same as BeautifulSoup's get_text(strip=True)
+
+    def handle_endtag(self, tag):
+        if tag != "a" or self._text is None:
+            return
+        href, text = self._href, "".join(self._text)
+        self._href = self._text = None
+        if href is None:
+            return
+        match = HREF_PATTERN.search(href)
+        if match:
+            coord_match = COORD_PATTERN.match(text)  # e.g. "10:44390336-44390351"
+            if coord_match:
+                self.rows.append([match.group(1), *coord_match.groups()])
+
+
+def extract_links(input_html):
+    """Stream (repeat_id, chrom, start, end) rows from a WebSTR export, reading it in chunks."""
+    parser = RepeatLinkParser()
+    with open(input_html, "r", encoding="utf-8") as f:
+        while True:
+            chunk = f.read(READ_CHUNK_CHARS)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            yield from parser.rows
+            parser.rows.clear()
+    parser.close()
+    yield from parser.rows
+
+
+def extract_links_soup(input_html):
+    """The original BeautifulSoup extraction: parses the whole file into a tree first."""
+    from bs4 import BeautifulSoup
+
+    # Read the HTML file
+    with open(input_html, "r", encoding="utf-8") as f:
+        soup = BeautifulSoup(f, "html.parser")
+
+    # Find all <a> tags with href containing repeat_id and hg38
+    for link in soup.find_all("a", href=True):
+        href = link["href"]
+        text = link.get_text(strip=True)  # Extract visible text (e.g., "10:44390336-44390351")
+
+        match = HREF_PATTERN.search(href)
+        if match:
+            coord_match = COORD_PATTERN.match(text)
+            if coord_match:
+                yield [match.group(1), *coord_match.groups()]
+
+
+def write_csv(rows, output_csv):
+    count = 0
+    with open(output_csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["repeat_id", "chrom", "start", "end"])
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def write_db(rows, db_path, tolerance=0):
+    """
+    Label locus_data.repeat_id straight from the extracted rows (no CSV),
+    streaming them into update_db_repeat_ids' temp table and applying it
+    in one UPDATE. Returns (rows extracted, loci updated).
+    """
+    count = 0
+
+    def mappings():
+        nonlocal count
+        for repeat_id, chrom, start, _ in rows:
+            count += 1
+            yield (f"chr{chrom}", int(start), repeat_id)
+
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    update_db_repeat_ids.load_mapping_table(cur, mappings())
+    updated_count = update_db_repeat_ids.apply_mapping_table(cur, tolerance)
+    conn.commit()
+    conn.close()
+    return count, updated_count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Extract (repeat_id, chrom, start, end) from a WebSTR gwas_hg38.html export"
+    )
+    parser.add_argument("--input-html", default=INPUT_HTML, help="Path to the WebSTR HTML export.")
+    parser.add_argument("--output-csv", default=OUTPUT_CSV, help="CSV to write (ignored with --db-path).")
+    parser.add_argument(
+        "--db-path",
+        default=None,
+        help="Fill in locus_data.repeat_id in this database directly instead of writing a CSV.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=int,
+        default=0,
+        help="With --db-path: match the nearest start within this many bp (default: 0, exact).",
+    )
+    parser.add_argument(
+        "--parser",
+        choices=["stream", "soup"],
+        default="stream",
+        help="stream: incremental parse in constant memory (default); soup: load the whole file into BeautifulSoup.",
+    )
+    args = parser.parse_args()
+
+    rows = extract_links(args.input_html) if args.parser == "stream" else extract_links_soup(args.input_html)
+
+    if args.db_path:
+        count, updated_count = write_db(rows, args.db_path, args.tolerance)
+        print(f"Extracted {count} entries and updated {updated_count} loci in {args.db_path}")
+    else:
+        count = write_csv(rows, args.output_csv)
+        print(f"Extracted {count} entries and saved to {args.output_csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 import argparse
+import bisect
 import os
 import shutil
 import re
 import csv
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import header_index
+import run_stats
 
 
 def normalize_chrom(chrom):
@@ -55,6 +61,28 @@ def extract_phenotype(header_keys):
     return "ambiguous"
 
 
+def read_locus_header(file_path):
+    """
+    Read the header and first row of a tab-delimited locus file.
+    Returns (header_keys, file_chrom, file_pos); file_chrom and file_pos are
+    None if the file has no data row or an unparseable position.
+    """
+    with open(file_path, "r") as f:
+        reader = csv.DictReader(f, delimiter="\t")
+        header_keys = reader.fieldnames
+        row = next(reader, None)
+        # Bytes actually pulled from the file (one buffer for a small file).
+        run_stats.add_bytes(f.buffer.raw.tell())
+        if row is None:
+            return (header_keys, None, None)
+        file_chrom = normalize_chrom(row.get("chrom", ""))
+        try:
+            file_pos = int(row.get("pos", "0"))
+        except ValueError:
+            return (header_keys, None, None)
+        return (header_keys, file_chrom, file_pos)
+
+
 def file_matches_query(file_path, query_chrom, query_pos, tolerance):
     """
     Open the file (assumed to be tab-delimited with a header) and check whether:
@@ -66,24 +94,68 @@ def file_matches_query(file_path, query_chrom, query_pos, tolerance):
       - header_keys is the list of header column names.
     """
     try:
-        with open(file_path, "r") as f:
-            reader = csv.DictReader(f, delimiter="\t")
-            header_keys = reader.fieldnames
-            row = next(reader, None)
-            if row is None:
-                return (False, None, None, header_keys)
-            file_chrom = normalize_chrom(row.get("chrom", ""))
-            try:
-                file_pos = int(row.get("pos", "0"))
-            except ValueError:
-                return (False, None, None, header_keys)
-            if file_chrom == query_chrom and abs(file_pos - query_pos) <= tolerance:
-                return (True, file_chrom, file_pos, header_keys)
+        header_keys, file_chrom, file_pos = read_locus_header(file_path)
+        if file_chrom is None:
+            return (False, None, None, header_keys)
+        if file_chrom == query_chrom and abs(file_pos - query_pos) <= tolerance:
+            return (True, file_chrom, file_pos, header_keys)
     except Exception as e:
         print(f"Error reading {file_path}: {e}")
     return (False, None, None, None)
 
 
+def build_locus_index(source_dir, index_path=None):
+    """
+    Read every file's header once and index the files by chromosome.
+    If index_path is given, headers come from the persistent header index
+    (header_index.py) and only new or changed files are read.
+    Returns {chrom: (positions, entries)} where positions is sorted and
+    entries[i] = (file_pos, listing_order, fname, phenotype) for positions[i].
+    """
+    headers = header_index.load_headers(source_dir, index_path) if index_path else None
+    by_chrom = {}
+    for order, fname in enumerate(os.listdir(source_dir)):
+        fpath = os.path.join(source_dir, fname)
+        if headers is not None:
+            if fname not in headers:
+                continue
+            raw_chrom, file_pos, _, header_keys = headers[fname]
+            # A missing chrom normalizes to "", as read_locus_header does.
+            file_chrom = normalize_chrom(raw_chrom or "") if file_pos is not None else None
+        elif not os.path.isfile(fpath):
+            continue
+        else:
+            try:
+                header_keys, file_chrom, file_pos = read_locus_header(fpath)
+            except Exception as e:
+                print(f"Error reading {fpath}: {e}")
+                continue
+        if file_chrom is None:
+            continue
+        run_stats.count_file()
+        phenotype = extract_phenotype(header_keys) if header_keys else "ambiguous"
+        by_chrom.setdefault(file_chrom, []).append((file_pos, order, fname, phenotype))
+
+    index = {}
+    for chrom, entries in by_chrom.items():
+        entries.sort()
+        index[chrom] = ([e[0] for e in entries], entries)
+    return index
+
+
+def lookup_window(index, query_chrom, query_pos, tolerance):
+    """
+    Return the index entries within tolerance bp of query_pos, in the
+    source directory's listing order.
+    """
+    if query_chrom not in index:
+        return []
+    positions, entries = index[query_chrom]
+    lo = bisect.bisect_left(positions, query_pos - tolerance)
+    hi = bisect.bisect_right(positions, query_pos + tolerance)
+    return sorted(entries[lo:hi], key=lambda e: e[1])
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Copy locus files matching query positions with phenotype extraction from header"
@@ -107,59 +179,63 @@ def main():
         default=100,
         help="Tolerance (in base pairs) for matching the starting position (default: 100)",
     )
+    parser.add_argument(
+        "--index-path",
+        default=None,
+        help="Read file headers from this persistent header index (see header_index.py) instead of opening every file",
+    )
+
+    run_stats.add_arguments(parser)
 
     args = parser.parse_args()
 
-    # Read query positions.
-    queries = parse_query_file(args.query_file)
-    if not queries:
-        print("No valid queries found.")
-        return
-
-    # File to store not found queries
-    not_found_file = os.path.join(args.output_dir_base, "not_found_queries.txt")
-    
-    # Open the file in write mode (overwrite if exists)
-    with open(not_found_file, "w") as nf:
-        nf.write("Phenotype\tChromosome\tPosition\n")  # Add a header
-
-        # Process each query.
-        for qchrom, qpos in queries:
-            print(f"Processing query: chrom {qchrom}, pos {qpos}")
-            match_count = 0
-
-            # Loop over all files in the source directory.
-            for fname in os.listdir(args.source_dir):
-                fpath = os.path.join(args.source_dir, fname)
-                if not os.path.isfile(fpath):
-                    continue
-
-                matches, file_chrom, file_pos, header_keys = file_matches_query(
-                    fpath, qchrom, qpos, tolerance=args.tolerance
-                )
-                if not matches:
-                    continue
-
-                # Extract phenotype from the file's header.
-                phenotype = extract_phenotype(header_keys) if header_keys else "ambiguous"
-
-                # Create the output directory for this phenotype if it doesn't exist.
-                out_dir = os.path.join(args.output_dir_base, phenotype)
-                os.makedirs(out_dir, exist_ok=True)
-
-                match_count += 1
-                # Construct a new file name: {phenotype}_{chrom}_{pos}_{i}{ext}
-                _, ext = os.path.splitext(fname)
-                new_fname = f"{phenotype}_{file_chrom}_{file_pos}_{match_count}{ext}"
-                dest_path = os.path.join(out_dir, new_fname)
-                shutil.copy(fpath, dest_path)
-                print(f"Copied {fpath} to {dest_path}")
-
-            # If no matches were found, log the missing query
-            if match_count == 0:
-                phenotype = "unknown"  # Since we can't extract phenotype without finding a file
-                nf.write(f"{phenotype}\t{qchrom}\t{qpos}\n")
-                print(f"No files found for query: chrom {qchrom}, pos {qpos} (Logged in not_found_queries.txt)")
+    with run_stats.session(args):
+        # Read query positions.
+        with run_stats.stage("queries"):
+            queries = parse_query_file(args.query_file)
+        if not queries:
+            print("No valid queries found.")
+            return
+
+        # File to store not found queries
+        not_found_file = os.path.join(args.output_dir_base, "not_found_queries.txt")
+
+        # Open the file in write mode (overwrite if exists)
+        with open(not_found_file, "w") as nf:
+            nf.write("Phenotype\tChromosome\tPosition\n")  # Add a header
+
+            # Read every file's chrom/pos once, then answer each query by binary search.
+            with run_stats.stage("index"):
+                index = build_locus_index(args.source_dir, args.index_path)
+
+            # Process each query.
+            for qchrom, qpos in queries:
+                print(f"Processing query: chrom {qchrom}, pos {qpos}")
+                match_count = 0
+
+                for file_pos, _, fname, phenotype in lookup_window(
+                    index, qchrom, qpos, args.tolerance
+                ):
+                    fpath = os.path.join(args.source_dir, fname)
+
+                    # Create the output directory for this phenotype if it doesn't exist.
+                    out_dir = os.path.join(args.output_dir_base, phenotype)
+                    os.makedirs(out_dir, exist_ok=True)
+
+                    match_count += 1
+                    # Construct a new file name: {phenotype}_{chrom}_{pos}_{i}{ext}
+                    _, ext = os.path.splitext(fname)
+                    new_fname = f"{phenotype}_{qchrom}_{file_pos}_{match_count}{ext}"
+                    dest_path = os.path.join(out_dir, new_fname)
+                    with run_stats.stage("copy"):
+                        shutil.copy(fpath, dest_path)
+                    print(f"Copied {fpath} to {dest_path}")
+
+                # If no matches were found, log the missing query
+                if match_count == 0:
+                    phenotype = "unknown"  # Since we can't extract phenotype without finding a file
+                    nf.write(f"{phenotype}\t{qchrom}\t{qpos}\n")
+                    print(f"No files found for query: chrom {qchrom}, pos {qpos} (Logged in not_found_queries.txt)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,1005 @@
+#!/usr/bin/env python3
+"""
+Schema and migrations for locus_data.db.
+
+Each locus is one typed row in 'locus_data', and its per-summed-length
+statistics live in the 'locus_alleles' child table, clustered on
+(locus_id, summed_length) so a plot is a single range read. Per-allele
+frequencies are keyed by single allele length rather than summed length,
+so they get their own child table, 'locus_allele_frequency'.
+
+The schema version is tracked with PRAGMA user_version; upgrade_db() applies
+every pending migration in order.
+"""
+import argparse
+import ast
+import contextlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import urllib.parse
+
+
+SCHEMA_VERSION = 6
+
+TOTAL_COLUMN_NAME = "sample_count_per_summed_length"
+CI_COLUMN_NAME = "summed_length_0.05_alpha_CI"
+
+LOCUS_COLUMNS = (
+    "phenotype",
+    "chrom",
+    "pos",
+    "repeat_id",
+    "trait",
+    "p_value",
+    "coeff",
+    "se",
+    "regression_r2",
+    "motif",
+    "period",
+    "ref_len",
+    "n_samples_tested",
+    "locus_filtered",
+    "alleles",
+)
+
+
+def parse_dict_field(value):
+    """
+    Parse a dict column from a locus file or a legacy data_json row.
+    Values are usually JSON, but files written from Python use literal syntax.
+    """
+    if value is None:
+        return {}
+    if isinstance(value, dict):
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        return ast.literal_eval(value)
+
+
+def _to_float(x):
+    """Convert a value to float, mapping None, NaN and unparseable values (e.g. 'NA') to None (NULL)."""
+    if x is None:
+        return None
+    try:
+        x = float(x)
+    except (TypeError, ValueError):
+        return None
+    return None if x != x else x
+
+
+def _to_int(x):
+    x = _to_float(x)
+    return None if x is None else int(x)
+
+
+def _to_bool_int(x):
+    """Store booleans ('True'/'False' strings included) as 0/1."""
+    if isinstance(x, str) and x.lower() in ("true", "false"):
+        return int(x.lower() == "true")
+    return _to_int(x)
+
+
+def find_trait(row):
+    """Return the trait suffix of the 'p_<trait>' column, or None."""
+    return next((k[2:] for k in row.keys() if k.startswith("p_")), None)
+
+
+def find_mean_column(row):
+    """Return the name of the 'mean_*' column, or None."""
+    return next((k for k in row.keys() if k.startswith("mean_")), None)
+
+
+def locus_record(phenotype, row, repeat_id=None):
+    """
+    Split one locus file row into typed locus values, per-summed-length
+    allele rows and per-allele frequency rows.
+    """
+    trait = find_trait(row)
+    locus = {
+        "phenotype": phenotype,
+        "chrom": row.get("chrom"),
+        "pos": _to_int(row.get("pos")),
+        "repeat_id": repeat_id,
+        "trait": trait,
+        "p_value": _to_float(row.get(f"p_{trait}")) if trait else None,
+        "coeff": _to_float(row.get(f"coeff_{trait}")) if trait else None,
+        "se": _to_float(row.get(f"se_{trait}")) if trait else None,
+        "regression_r2": _to_float(row.get("regression_R^2")),
+        "motif": row.get("motif"),
+        "period": _to_int(row.get("period")),
+        "ref_len": _to_float(row.get("ref_len")),
+        "n_samples_tested": _to_int(row.get("n_samples_tested")),
+        "locus_filtered": _to_bool_int(row.get("locus_filtered")),
+        "alleles": row.get("alleles"),
+    }
+
+    count_dict = parse_dict_field(row.get(TOTAL_COLUMN_NAME))
+    mean_col_name = find_mean_column(row)
+    mean_dict = parse_dict_field(row.get(mean_col_name)) if mean_col_name else {}
+    ci_dict = parse_dict_field(row.get(CI_COLUMN_NAME))
+
+    allele_rows = []
+    for allele in sorted(set(count_dict) | set(mean_dict) | set(ci_dict), key=float):
+        ci = ci_dict.get(allele) or [None, None]
+        allele_rows.append(
+            (
+                float(allele),
+                _to_int(count_dict.get(allele)),
+                _to_float(mean_dict.get(allele)),
+                _to_float(ci[0]),
+                _to_float(ci[1]),
+            )
+        )
+
+    freq_rows = [
+        (float(allele), _to_float(freq))
+        for allele, freq in parse_dict_field(row.get("allele_frequency")).items()
+    ]
+
+    return locus, allele_rows, freq_rows
+
+
+INSERT_LOCUS_SQL = f"""
+    INSERT INTO locus_data (id, {", ".join(LOCUS_COLUMNS)})
+    VALUES (?, {", ".join("?" * len(LOCUS_COLUMNS))})
+"""
+
+INSERT_ALLELE_SQL = """
+    INSERT INTO locus_alleles (locus_id, summed_length, sample_count, mean, ci_low, ci_high)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_FREQUENCY_SQL = """
+    INSERT INTO locus_allele_frequency (locus_id, allele_length, allele_frequency)
+    VALUES (?, ?, ?)
+"""
+
+
+def insert_locus(conn, phenotype, row, repeat_id=None, locus_id=None):
+    """
+    Insert one locus file row and its allele rows. Does not commit.
+    Returns the new locus id.
+    """
+    locus, allele_rows, freq_rows = locus_record(phenotype, row, repeat_id)
+    cur = conn.cursor()
+    cur.execute(INSERT_LOCUS_SQL, (locus_id, *(locus[c] for c in LOCUS_COLUMNS)))
+    locus_id = cur.lastrowid
+    cur.executemany(INSERT_ALLELE_SQL, [(locus_id, *r) for r in allele_rows])
+    cur.executemany(INSERT_FREQUENCY_SQL, [(locus_id, *r) for r in freq_rows])
+    return locus_id
+
+
+NATURAL_KEY = ("phenotype", "chrom", "pos")
+
+# Re-imports update a locus in place; repeat_id is assigned after import
+# (templates/update_db_repeat_ids.py), so an upsert never overwrites it.
+UPSERT_LOCUS_SQL = f"""
+    INSERT INTO locus_data ({", ".join(LOCUS_COLUMNS)})
+    VALUES ({", ".join("?" * len(LOCUS_COLUMNS))})
+    ON CONFLICT ({", ".join(NATURAL_KEY)}) DO UPDATE SET
+        {", ".join(f"{c} = excluded.{c}" for c in LOCUS_COLUMNS if c not in NATURAL_KEY and c != "repeat_id")}
+    RETURNING id
+"""
+
+
+def upsert_locus_records(conn, records):
+    """
+    Insert or update locus_record() results on (phenotype, chrom, pos) and
+    replace their allele rows; any precomputed default plot for an updated
+    locus is dropped. Does not commit. Within one call the last record for
+    a (phenotype, chrom, pos) wins.
+    Returns the list of locus ids (in record order) and the number of
+    allele rows written.
+    """
+    # Records sharing a natural key (e.g. a copied file) resolve to the same
+    # locus; only the last one's allele rows are written. NULL keys never
+    # conflict, so they are always distinct.
+    last = {}
+    for i, (locus, _, _) in enumerate(records):
+        key = tuple(locus[c] for c in NATURAL_KEY)
+        last[key if None not in key else i] = i
+    if len(last) < len(records):
+        print(
+            f"[WARNING] {len(records) - len(last)} loci repeat a (phenotype, chrom, pos) "
+            "earlier in the same batch; keeping the last of each."
+        )
+    winners = set(last.values())
+
+    cur = conn.cursor()
+    locus_ids = []
+    allele_rows = []
+    freq_rows = []
+    for i, (locus, alleles, freqs) in enumerate(records):
+        locus_id = cur.execute(
+            UPSERT_LOCUS_SQL, tuple(locus[c] for c in LOCUS_COLUMNS)
+        ).fetchone()[0]
+        locus_ids.append(locus_id)
+        if i in winners:
+            allele_rows.extend((locus_id, *r) for r in alleles)
+            freq_rows.extend((locus_id, *r) for r in freqs)
+
+    stale = [(i,) for i in locus_ids]
+    cur.executemany("DELETE FROM locus_default_plot WHERE locus_id = ?", stale)
+    cur.executemany("DELETE FROM locus_alleles WHERE locus_id = ?", stale)
+    cur.executemany("DELETE FROM locus_allele_frequency WHERE locus_id = ?", stale)
+    cur.executemany(INSERT_ALLELE_SQL, allele_rows)
+    cur.executemany(INSERT_FREQUENCY_SQL, freq_rows)
+    return locus_ids, len(allele_rows)
+
+
+def delete_loci(conn, locus_ids):
+    """Delete loci, their allele rows and derived data. Does not commit."""
+    rows = [(i,) for i in locus_ids]
+    conn.executemany("DELETE FROM locus_default_plot WHERE locus_id = ?", rows)
+    conn.executemany("DELETE FROM locus_alleles WHERE locus_id = ?", rows)
+    conn.executemany("DELETE FROM locus_allele_frequency WHERE locus_id = ?", rows)
+    conn.executemany("DELETE FROM locus_data WHERE id = ?", rows)
+
+
+def load_manifest(conn, path_prefix):
+    """
+    Return {source_path: (size, mtime_ns, content_hash, locus_id)} for every
+    manifest entry at or below path_prefix.
+    """
+    directory = path_prefix.rstrip(os.sep) + os.sep
+    # Paths below the directory sort between "dir/" and "dir0" ("0" follows "/").
+    upper = directory[:-1] + chr(ord(os.sep) + 1)
+    rows = conn.execute(
+        """
+        SELECT source_path, size, mtime_ns, content_hash, locus_id
+        FROM import_manifest
+        WHERE source_path = ? OR (source_path >= ? AND source_path < ?)
+    """,
+        (path_prefix, directory, upper),
+    )
+    return {r[0]: r[1:] for r in rows}
+
+
+def record_manifest(conn, entries):
+    """
+    Upsert (source_path, size, mtime_ns, content_hash, locus_id) manifest
+    entries. Does not commit.
+    """
+    conn.executemany(
+        """
+        INSERT INTO import_manifest (source_path, size, mtime_ns, content_hash, locus_id)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (source_path) DO UPDATE SET
+            size = excluded.size,
+            mtime_ns = excluded.mtime_ns,
+            content_hash = excluded.content_hash,
+            locus_id = excluded.locus_id
+    """,
+        entries,
+    )
+
+
+def forget_sources(conn, source_paths):
+    """
+    Drop manifest entries for source files that no longer exist, and delete
+    their loci unless another manifest entry still points at them.
+    Does not commit. Returns the number of loci deleted.
+    """
+    if not source_paths:
+        return 0
+    locus_ids = {
+        r[0]
+        for p in source_paths
+        for r in conn.execute(
+            "SELECT locus_id FROM import_manifest WHERE source_path = ? AND locus_id IS NOT NULL",
+            (p,),
+        )
+    }
+    conn.executemany(
+        "DELETE FROM import_manifest WHERE source_path = ?", [(p,) for p in source_paths]
+    )
+    return delete_orphaned_loci(conn, locus_ids)
+
+
+def delete_orphaned_loci(conn, locus_ids):
+    """
+    Delete those of locus_ids that no manifest entry points at any more
+    (e.g. after their source file was removed, or edited to a new chrom/pos).
+    Does not commit. Returns the number of loci deleted.
+    """
+    orphans = [
+        i
+        for i in locus_ids
+        if conn.execute(
+            "SELECT 1 FROM import_manifest WHERE locus_id = ? LIMIT 1", (i,)
+        ).fetchone()
+        is None
+    ]
+    delete_loci(conn, orphans)
+    return len(orphans)
+
+
+@contextlib.contextmanager
+def bulk_load(conn):
+    """
+    Switch the connection to WAL with relaxed syncing and a large page cache
+    for the duration of a bulk load, then checkpoint and restore the
+    default rollback journal so the file can be shipped or opened read-only.
+    """
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    conn.execute("PRAGMA cache_size = -262144;")  # 256 MiB
+    try:
+        yield conn
+    finally:
+        conn.commit()
+        conn.execute("PRAGMA synchronous = FULL;")
+        conn.execute("PRAGMA journal_mode = DELETE;")
+
+
+def allele_dicts(rows):
+    """
+    Turn (summed_length, sample_count, mean, ci_low, ci_high) rows into the
+    allele-keyed (dosage_dict, mean_dict, ci_dict) used by the plotting code.
+    NULLs in the table stand for NaN.
+    """
+    nan = float("nan")
+    dosage_dict = {}
+    mean_dict = {}
+    ci_dict = {}
+    for summed_length, count, mean_val, lower, upper in rows:
+        allele = str(summed_length)
+        dosage_dict[allele] = count if count is not None else 0
+        mean_dict[allele] = mean_val if mean_val is not None else nan
+        ci_dict[allele] = [
+            lower if lower is not None else nan,
+            upper if upper is not None else nan,
+        ]
+    return dosage_dict, mean_dict, ci_dict
+
+
+def allele_series_query(
+    phenotype=None,
+    repeat_ids=None,
+    chrom=None,
+    start=None,
+    end=None,
+    without_default_plot=False,
+    locus_ids=None,
+):
+    """Build the (sql, params) statement iter_allele_series() runs for these filters."""
+    conditions = []
+    params = []
+    if phenotype is not None:
+        conditions.append("l.phenotype = ?")
+        params.append(phenotype)
+    if repeat_ids:
+        conditions.append(f"l.repeat_id IN ({', '.join('?' * len(repeat_ids))})")
+        params.extend(repeat_ids)
+    if chrom is not None:
+        conditions.append("l.chrom = ?")
+        params.append(chrom)
+    if start is not None:
+        conditions.append("l.pos >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append("l.pos <= ?")
+        params.append(end)
+    if without_default_plot:
+        conditions.append("l.id NOT IN (SELECT locus_id FROM locus_default_plot)")
+    if locus_ids:
+        conditions.append(f"l.id IN ({', '.join('?' * len(locus_ids))})")
+        params.extend(locus_ids)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"""
+        SELECT l.id, l.phenotype, l.chrom, l.pos, l.repeat_id,
+               a.summed_length, a.sample_count, a.mean, a.ci_low, a.ci_high
+        FROM locus_data l JOIN locus_alleles a ON a.locus_id = l.id
+        {where}
+        ORDER BY l.phenotype, l.chrom, l.pos, a.summed_length
+    """
+    return sql, params
+
+
+def iter_allele_series(
+    conn,
+    phenotype=None,
+    repeat_ids=None,
+    chrom=None,
+    start=None,
+    end=None,
+    without_default_plot=False,
+    locus_ids=None,
+):
+    """
+    Stream loci with their allele series in one sequential read, ordered by
+    (phenotype, chrom, pos). Filters combine with AND; repeat_ids and
+    locus_ids are lists, and without_default_plot keeps only loci missing
+    from locus_default_plot.
+    Yields (locus, dosage_dict, mean_dict, ci_dict) where locus is a dict of
+    id, phenotype, chrom, pos and repeat_id.
+    """
+    rows = conn.execute(
+        *allele_series_query(
+            phenotype, repeat_ids, chrom, start, end, without_default_plot, locus_ids
+        )
+    )
+    for key, group in itertools.groupby(rows, key=lambda r: r[:5]):
+        locus = dict(zip(("id", "phenotype", "chrom", "pos", "repeat_id"), key))
+        yield (locus, *allele_dicts(r[5:] for r in group))
+
+
+# The locus /test_locus shows for a repeat_id with several phenotypes: the
+# alphabetically first, i.e. the first facet of the multi-phenotype view.
+FIRST_LOCUS_BY_REPEAT_ID_SQL = (
+    "SELECT id FROM locus_data WHERE repeat_id = ? ORDER BY phenotype, id LIMIT 1"
+)
+
+
+# One row per position in the region. SQLite fills the bare phenotype and
+# repeat_id columns from the row holding MIN(p_value).
+REGION_SQL = """
+    SELECT chrom, pos, repeat_id, MIN(p_value) AS lead_p_value, phenotype, COUNT(*)
+    FROM locus_data
+    WHERE chrom = ? AND pos BETWEEN ? AND ?
+    GROUP BY pos
+    ORDER BY {order}
+    LIMIT ? OFFSET ?
+"""
+
+REGION_SORTS = {
+    "pos": "pos",
+    "p_value": "lead_p_value IS NULL, lead_p_value, pos",
+}
+
+
+def query_region(conn, chrom, start, end, sort="pos", limit=100, offset=0):
+    """
+    Loci with start <= pos <= end on chrom, one per position with its lead
+    (smallest) p-value across phenotypes, sorted by "pos" or "p_value" and
+    paged with limit/offset. Returns (total, loci) where total counts every
+    position in the region and each locus is a dict of chrom, pos,
+    repeat_id, lead_p_value, lead_phenotype and n_phenotypes.
+    """
+    if sort not in REGION_SORTS:
+        raise ValueError(f"sort must be one of {', '.join(REGION_SORTS)}, not {sort!r}")
+    total = conn.execute(
+        "SELECT COUNT(DISTINCT pos) FROM locus_data WHERE chrom = ? AND pos BETWEEN ? AND ?",
+        (chrom, start, end),
+    ).fetchone()[0]
+    rows = conn.execute(
+        REGION_SQL.format(order=REGION_SORTS[sort]), (chrom, start, end, limit, offset)
+    )
+    keys = ("chrom", "pos", "repeat_id", "lead_p_value", "lead_phenotype", "n_phenotypes")
+    return total, [dict(zip(keys, row)) for row in rows]
+
+
+TOP_HITS_SQL = """
+    SELECT chrom, pos, repeat_id, p_value, coeff, se
+    FROM locus_data
+    WHERE phenotype = ? AND p_value IS NOT NULL
+    ORDER BY p_value
+    LIMIT ?
+"""
+
+
+# Distinct phenotypes by seeking the index once per phenotype rather than
+# scanning every row.
+PHENOTYPES_SQL = """
+    WITH RECURSIVE p(phenotype) AS (
+        SELECT MIN(phenotype) FROM locus_data
+        UNION ALL
+        SELECT (SELECT MIN(phenotype) FROM locus_data WHERE phenotype > p.phenotype)
+        FROM p WHERE p.phenotype IS NOT NULL
+    )
+    SELECT phenotype FROM p WHERE phenotype IS NOT NULL
+"""
+
+
+def top_hits(conn, k=10, phenotypes=None):
+    """
+    The k loci with the smallest p-values for each phenotype (every
+    phenotype if none are given), each read as one short index range scan.
+    Returns {phenotype: [{chrom, pos, repeat_id, p_value, coeff, se}, ...]}.
+    """
+    if phenotypes is None:
+        phenotypes = [r[0] for r in conn.execute(PHENOTYPES_SQL)]
+    keys = ("chrom", "pos", "repeat_id", "p_value", "coeff", "se")
+    return {
+        phenotype: [dict(zip(keys, row)) for row in conn.execute(TOP_HITS_SQL, (phenotype, k))]
+        for phenotype in phenotypes
+    }
+
+
+def _table_columns(conn, table):
+    return [col[1] for col in conn.execute(f"PRAGMA table_info({table});")]
+
+
+def _create_v1_tables(conn):
+    conn.execute(
+        """
+        CREATE TABLE locus_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phenotype TEXT,
+            chrom TEXT,
+            pos INTEGER,
+            repeat_id TEXT,
+            trait TEXT,
+            p_value REAL,
+            coeff REAL,
+            se REAL,
+            regression_r2 REAL,
+            motif TEXT,
+            period INTEGER,
+            ref_len REAL,
+            n_samples_tested INTEGER,
+            locus_filtered INTEGER,
+            alleles TEXT
+        );
+    """
+    )
+    conn.execute(
+        """
+        CREATE TABLE locus_alleles (
+            locus_id INTEGER NOT NULL REFERENCES locus_data(id) ON DELETE CASCADE,
+            summed_length REAL NOT NULL,
+            sample_count INTEGER,
+            mean REAL,
+            ci_low REAL,
+            ci_high REAL,
+            PRIMARY KEY (locus_id, summed_length)
+        ) WITHOUT ROWID;
+    """
+    )
+    conn.execute(
+        """
+        CREATE TABLE locus_allele_frequency (
+            locus_id INTEGER NOT NULL REFERENCES locus_data(id) ON DELETE CASCADE,
+            allele_length REAL NOT NULL,
+            allele_frequency REAL,
+            PRIMARY KEY (locus_id, allele_length)
+        ) WITHOUT ROWID;
+    """
+    )
+
+
+def _migrate_to_v1(conn):
+    """
+    Replace the data_json blob with typed locus columns and allele child tables.
+    Existing rows keep their id and repeat_id.
+    """
+    columns = _table_columns(conn, "locus_data")
+    if not columns:
+        _create_v1_tables(conn)
+        return
+    if "data_json" not in columns:
+        raise RuntimeError(
+            "locus_data has neither the legacy data_json column nor a schema version."
+        )
+
+    conn.execute("ALTER TABLE locus_data RENAME TO locus_data_v0;")
+    _create_v1_tables(conn)
+
+    repeat_id_col = "repeat_id" if "repeat_id" in columns else "NULL"
+    legacy_rows = conn.execute(
+        f"SELECT id, phenotype, data_json, {repeat_id_col} FROM locus_data_v0 ORDER BY id"
+    )
+    migrated = 0
+    for locus_id, phenotype, data_json, repeat_id in legacy_rows.fetchall():
+        insert_locus(
+            conn, phenotype, json.loads(data_json), repeat_id=repeat_id, locus_id=locus_id
+        )
+        migrated += 1
+
+    conn.execute("DROP TABLE locus_data_v0;")
+    print(f"[INFO] Migrated {migrated} legacy locus_data rows to schema version 1.")
+
+
+# Secondary indexes on locus_data, keyed by index name.
+LOCUS_INDEXES = {
+    "idx_locus_data_repeat_id": "locus_data (repeat_id)",
+    "idx_locus_data_chrom_pos": "locus_data (chrom, pos)",
+    "idx_locus_data_phenotype": "locus_data (phenotype)",
+}
+
+
+def _migrate_to_v2(conn):
+    """Add the lookup indexes for repeat_id, (chrom, pos) and phenotype."""
+    for name, target in LOCUS_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target};")
+    conn.execute("ANALYZE;")
+
+
+def _locus_content(conn, locus_id):
+    """A locus's values other than id and repeat_id, plus its allele rows, for comparing duplicates."""
+    columns = ", ".join(c for c in LOCUS_COLUMNS if c != "repeat_id")
+    return (
+        conn.execute(f"SELECT {columns} FROM locus_data WHERE id = ?", (locus_id,)).fetchone(),
+        conn.execute(
+            "SELECT summed_length, sample_count, mean, ci_low, ci_high FROM locus_alleles "
+            "WHERE locus_id = ? ORDER BY summed_length",
+            (locus_id,),
+        ).fetchall(),
+        conn.execute(
+            "SELECT allele_length, allele_frequency FROM locus_allele_frequency "
+            "WHERE locus_id = ? ORDER BY allele_length",
+            (locus_id,),
+        ).fetchall(),
+    )
+
+
+def _migrate_to_v3(conn):
+    """
+    Make (phenotype, chrom, pos) a unique natural key and add the import
+    manifest used for incremental re-imports. Duplicate loci left by earlier
+    re-imports are collapsed onto the lowest id, which takes the first
+    non-empty repeat_id of its group if it has none; every dropped id is
+    logged, with a warning for those whose data differed from the kept row.
+    """
+    groups = conn.execute(
+        """
+        SELECT GROUP_CONCAT(id) FROM locus_data
+        WHERE phenotype IS NOT NULL AND chrom IS NOT NULL AND pos IS NOT NULL
+        GROUP BY phenotype, chrom, pos
+        HAVING COUNT(*) > 1
+    """
+    ).fetchall()
+    duplicates = []
+    for (ids,) in groups:
+        keep, *drop = sorted(int(i) for i in ids.split(","))
+        kept_content = _locus_content(conn, keep)
+        differing = [i for i in drop if _locus_content(conn, i) != kept_content]
+        repeat_ids = [
+            r[0]
+            for r in conn.execute(
+                f"SELECT repeat_id FROM locus_data WHERE id IN ({', '.join('?' * (len(drop) + 1))}) ORDER BY id",
+                [keep] + drop,
+            )
+        ]
+        if not repeat_ids[0]:
+            adopted = next((r for r in repeat_ids if r), None)
+            if adopted:
+                conn.execute("UPDATE locus_data SET repeat_id = ? WHERE id = ?", (adopted, keep))
+        if differing:
+            print(
+                f"[WARNING] Locus {keep} kept over duplicates with different data: "
+                f"{', '.join(map(str, differing))}"
+            )
+        duplicates.extend(drop)
+    rows = [(i,) for i in duplicates]
+    for table, column in (
+        ("locus_alleles", "locus_id"),
+        ("locus_allele_frequency", "locus_id"),
+        ("locus_data", "id"),
+    ):
+        conn.executemany(f"DELETE FROM {table} WHERE {column} = ?", rows)
+    if duplicates:
+        print(
+            f"[INFO] Removed {len(duplicates)} duplicate loci while adding the natural key: "
+            f"{', '.join(map(str, duplicates))}"
+        )
+
+    # The unique key also serves phenotype lookups, so the v2 phenotype index goes.
+    conn.execute("DROP INDEX IF EXISTS idx_locus_data_phenotype;")
+    conn.execute(
+        "CREATE UNIQUE INDEX idx_locus_data_natural_key ON locus_data (phenotype, chrom, pos);"
+    )
+    conn.execute(
+        """
+        CREATE TABLE import_manifest (
+            source_path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER,
+            content_hash TEXT,
+            locus_id INTEGER REFERENCES locus_data(id) ON DELETE SET NULL
+        );
+    """
+    )
+    conn.execute("CREATE INDEX idx_import_manifest_locus_id ON import_manifest (locus_id);")
+
+
+def _migrate_to_v4(conn):
+    """
+    Add locus_default_plot, the precomputed filtered series and Plotly
+    payload for the default request thresholds.
+    """
+    conn.execute(
+        """
+        CREATE TABLE locus_default_plot (
+            locus_id INTEGER PRIMARY KEY REFERENCES locus_data(id) ON DELETE CASCADE,
+            count_threshold REAL NOT NULL,
+            series_json TEXT NOT NULL,
+            plot_json TEXT
+        );
+    """
+    )
+
+
+def _migrate_to_v5(conn):
+    """
+    Replace the (chrom, pos) index with a covering region index that also
+    holds p_value, phenotype and repeat_id, so region queries with lead
+    p-values are answered from the index alone.
+    """
+    conn.execute("DROP INDEX IF EXISTS idx_locus_data_chrom_pos;")
+    conn.execute(
+        "CREATE INDEX idx_locus_data_region ON locus_data (chrom, pos, p_value, phenotype, repeat_id);"
+    )
+    conn.execute("ANALYZE;")
+
+
+def _migrate_to_v6(conn):
+    """Add the (phenotype, p_value) index behind the per-phenotype top hits."""
+    conn.execute("CREATE INDEX idx_locus_data_phenotype_p ON locus_data (phenotype, p_value);")
+    conn.execute("ANALYZE;")
+
+
+# MIGRATIONS[i] upgrades a database from user_version i to i + 1.
+MIGRATIONS = [
+    _migrate_to_v1,
+    _migrate_to_v2,
+    _migrate_to_v3,
+    _migrate_to_v4,
+    _migrate_to_v5,
+    _migrate_to_v6,
+]
+
+
+# Query paths used by the web app and the CLI tools. check_query_plans()
+# fails if any of them would fall back to a full scan of a table.
+QUERY_PATHS = {
+    "allele series by repeat_id": (
+        f"""
+        SELECT summed_length, sample_count, mean, ci_low, ci_high
+        FROM locus_alleles
+        WHERE locus_id = ({FIRST_LOCUS_BY_REPEAT_ID_SQL})
+        ORDER BY summed_length
+        """,
+        ("0",),
+    ),
+    "default plot by repeat_id": (
+        f"""
+        SELECT plot_json FROM locus_default_plot
+        WHERE locus_id = ({FIRST_LOCUS_BY_REPEAT_ID_SQL})
+        """,
+        ("0",),
+    ),
+    "default series by repeat_id": (
+        """
+        SELECT l.phenotype, p.series_json
+        FROM locus_data l LEFT JOIN locus_default_plot p ON p.locus_id = l.id
+        WHERE l.repeat_id = ?
+        ORDER BY l.phenotype
+        """,
+        ("0",),
+    ),
+    "locus by (chrom, pos)": (
+        "SELECT id FROM locus_data WHERE chrom = ? AND pos = ?",
+        ("chr1", 0),
+    ),
+    "unlabelled loci by (chrom, pos)": (
+        "SELECT id FROM locus_data WHERE chrom = ? AND pos = ? AND (repeat_id IS NULL OR repeat_id = '')",
+        ("chr1", 0),
+    ),
+    "loci in region by position": (
+        REGION_SQL.format(order="pos"),
+        ("chr1", 0, 1, 10, 0),
+    ),
+    "loci in region by p-value": (
+        REGION_SQL.format(order="lead_p_value IS NULL, lead_p_value, pos"),
+        ("chr1", 0, 1, 10, 0),
+    ),
+    "top hits for a phenotype": (TOP_HITS_SQL, ("glucose", 10)),
+    "distinct phenotypes": (PHENOTYPES_SQL, ()),
+    "loci by phenotype": (
+        "SELECT id, chrom, pos FROM locus_data WHERE phenotype = ?",
+        ("glucose",),
+    ),
+    "loci per phenotype": (
+        "SELECT phenotype, COUNT(*) FROM locus_data GROUP BY phenotype",
+        (),
+    ),
+    "allele series for a phenotype": allele_series_query(phenotype="glucose"),
+    "allele series for repeat_ids": allele_series_query(repeat_ids=["0", "1"]),
+    "allele series in a region": allele_series_query(chrom="chr1", start=0, end=1),
+    "allele series without a default plot": allele_series_query(without_default_plot=True),
+    "allele series for locus ids": allele_series_query(locus_ids=[1, 2]),
+}
+
+
+def explain_query_plan(conn, sql, params=()):
+    """Return the EXPLAIN QUERY PLAN detail lines for a statement."""
+    return [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def check_query_plans(conn):
+    """
+    Run EXPLAIN QUERY PLAN over QUERY_PATHS and return a list of
+    (name, plan_line) for every path that scans a table without an index.
+    An empty list means every path is served by an index.
+    """
+    problems = []
+    for name, (sql, params) in QUERY_PATHS.items():
+        plan = [line.split() for line in explain_query_plan(conn, sql, params)]
+        # Scans of CTEs and subqueries (e.g. "SCAN p") are fine; they are
+        # named on their CO-ROUTINE or MATERIALIZE line. Anything else,
+        # aliased or not, is a table.
+        derived = {w[1] for w in plan if w[0] in ("CO-ROUTINE", "MATERIALIZE") and len(w) > 1}
+        for words in plan:
+            if words[0] == "SCAN" and words[1] not in derived and "INDEX" not in words:
+                problems.append((name, " ".join(words)))
+    return problems
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version;").fetchone()[0]
+
+
+def upgrade_db(conn):
+    """
+    Apply all pending migrations, each in its own transaction.
+    """
+    version = get_schema_version(conn)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema version {version} is newer than this code ({SCHEMA_VERSION})."
+        )
+    for target in range(version + 1, SCHEMA_VERSION + 1):
+        with conn:
+            conn.execute("BEGIN;")
+            MIGRATIONS[target - 1](conn)
+            conn.execute(f"PRAGMA user_version = {target};")
+    return conn
+
+
+def db_version(db_path):
+    """
+    Return a token that changes whenever the database file (or its WAL) is
+    rewritten, for keying caches of data read from it.
+    """
+    version = []
+    for path in (db_path, db_path + "-wal"):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        version.extend((stat.st_mtime_ns, stat.st_size))
+    return tuple(version)
+
+
+def connect(db_path):
+    """Open a read/write connection with foreign keys enforced."""
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA foreign_keys = ON;")
+    return conn
+
+
+READ_MMAP_SIZE = 256 * 1024 * 1024
+READ_CACHE_SIZE_KIB = 65536
+
+
+def connect_readonly(db_path, immutable=False):
+    """
+    Open a read-only connection through a SQLite URI (mode=ro, plus
+    immutable=1 if the file is guaranteed not to change while open), with
+    memory-mapped I/O and a larger page cache. The connection may be handed
+    between threads, but must only be used by one thread at a time.
+    """
+    uri = f"file:{urllib.parse.quote(os.path.abspath(db_path))}?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute(f"PRAGMA mmap_size = {READ_MMAP_SIZE};")
+    conn.execute(f"PRAGMA cache_size = -{READ_CACHE_SIZE_KIB};")
+    return conn
+
+
+class ReadOnlyPool:
+    """
+    Thread-safe pool of read-only connections to one database file.
+    Connections are opened lazily, reused most-recently-returned first (so
+    their page caches stay warm), and at most max_idle are kept. A pool
+    inherited across fork() is discarded rather than shared.
+    """
+
+    def __init__(self, db_path, max_idle=8, immutable=False):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.immutable = immutable
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = None
+        with self._lock:
+            if self._pid != os.getpid():
+                self._idle = []
+                self._pid = os.getpid()
+            if self._idle:
+                conn = self._idle.pop()
+        if conn is None:
+            conn = connect_readonly(self.db_path, self.immutable)
+        conn.set_trace_callback(_read_trace_callback)
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                if self._pid == os.getpid() and len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def reset(self):
+        """Close idle connections, e.g. after the database file was replaced."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_read_pools = {}
+_read_pools_lock = threading.Lock()
+_read_trace_callback = None
+
+
+def set_read_trace_callback(callback):
+    """
+    Call callback(sql) for every statement run on a pooled read-only
+    connection (applied as each connection is borrowed); None turns it off.
+    """
+    global _read_trace_callback
+    _read_trace_callback = callback
+
+
+def get_read_pool(db_path, immutable=False):
+    """Return this process's shared ReadOnlyPool for db_path."""
+    key = (os.path.abspath(db_path), immutable)
+    with _read_pools_lock:
+        pool = _read_pools.get(key)
+        if pool is None:
+            pool = _read_pools[key] = ReadOnlyPool(db_path, immutable=immutable)
+        return pool
+
+
+def read_connection(db_path, immutable=False):
+    """Borrow a pooled read-only connection: `with read_connection(path) as conn: ...`"""
+    return get_read_pool(db_path, immutable).connection()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Create or upgrade a locus_data.db to the current schema"
+    )
+    parser.add_argument("--db-path", required=True, help="Path to the SQLite database file.")
+    parser.add_argument(
+        "--check-plans",
+        action="store_true",
+        default=False,
+        help="After upgrading, verify with EXPLAIN QUERY PLAN that no query path scans a table.",
+    )
+    args = parser.parse_args()
+
+    conn = connect(args.db_path)
+    before = get_schema_version(conn)
+    upgrade_db(conn)
+    if before < get_schema_version(conn):
+        conn.execute("VACUUM;")
+    print(f"Schema version {before} -> {get_schema_version(conn)} for {args.db_path}")
+
+    if args.check_plans:
+        problems = check_query_plans(conn)
+        for name, line in problems:
+            print(f"[ERROR] Query path '{name}' falls back to a scan: {line}")
+        if problems:
+            conn.close()
+            raise SystemExit(1)
+        print(f"All {len(QUERY_PATHS)} query paths use an index.")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
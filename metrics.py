@@ -0,0 +1,172 @@
+"""
+In-process metrics for the Flask app. stage() times a block of work and
+feeds both the current request's Server-Timing header and a Prometheus
+histogram; render() writes every metric in the Prometheus text format for
+/metrics. Each observation is a perf_counter() pair, a bisect and a short
+locked update, so the timers can stay on in production. count_query() is
+the SQLite trace callback behind the per-request statement histogram.
+Metrics are per process: with several gunicorn workers, each one reports
+its own.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow renders.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# SQL statements per request; 0 is a cache hit.
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+
+
+def _labels(label, value, le=None):
+    parts = [] if label is None else [f'{label}="{value}"']
+    if le is not None:
+        parts.append(f'le="{le}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """Cumulative-bucket histogram (latencies by default) with one label dimension."""
+
+    def __init__(self, name, help_text, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {k: (list(v[0]), v[1]) for k, v in self._series.items()}
+        for value, (counts, total) in sorted(snapshot.items()):
+            cumulative = 0
+            for le, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.label, value, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label, value)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label, value)} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter with an optional label dimension."""
+
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        # An unlabelled counter reports 0 before its first increment.
+        self._values = {} if label else {None: 0}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value=None, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for value, count in sorted(snapshot.items(), key=lambda kv: str(kv[0])):
+            lines.append(f"{self.name}{_labels(self.label, value)} {count}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    "locus_request_duration_seconds", "Request latency by endpoint.", "endpoint"
+)
+STAGE_LATENCY = Histogram(
+    "locus_stage_duration_seconds", "Time spent in each stage of building a response.", "stage"
+)
+RESPONSES = Counter("locus_responses_total", "Responses by HTTP status code.", "status")
+DB_QUERIES = Counter(
+    "locus_db_queries_total", "SQLite statements run by this process on behalf of requests, in total."
+)
+QUERIES_PER_REQUEST = Histogram(
+    "locus_db_queries_per_request", "SQLite statements run per request, by endpoint.", "endpoint", QUERY_BUCKETS
+)
+
+# (stage, seconds) pairs for the request being handled in this context.
+_request_stages = contextvars.ContextVar("request_stages", default=None)
+# One-element list holding the number of statements the current request ran.
+_request_queries = contextvars.ContextVar("request_queries", default=None)
+
+
+def start_request():
+    """Begin collecting stage timings and query counts for a new request; returns its start time."""
+    _request_stages.set([])
+    _request_queries.set([0])
+    return time.perf_counter()
+
+
+def request_stages():
+    return _request_stages.get() or []
+
+
+def request_queries():
+    queries = _request_queries.get()
+    return queries[0] if queries is not None else 0
+
+
+def count_query(sql=None):
+    """SQLite trace callback: count one statement for the process and the current request."""
+    DB_QUERIES.inc()
+    queries = _request_queries.get()
+    if queries is not None:
+        queries[0] += 1
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as stage `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.observe(name, elapsed)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((name, elapsed))
+
+
+def server_timing(stages, total=None):
+    """
+    Format stage timings as a Server-Timing header value (durations in ms);
+    repeated stages are summed.
+    """
+    merged = {}
+    for name, seconds in stages:
+        merged[name] = merged.get(name, 0.0) + seconds
+    entries = [f"{name};dur={1e3 * seconds:.2f}" for name, seconds in merged.items()]
+    if total is not None:
+        entries.append(f"total;dur={1e3 * total:.2f}")
+    return ", ".join(entries)
+
+
+def render(counters=(), gauges=()):
+    """
+    Every metric in the Prometheus text format. counters and gauges are
+    iterables of (name, help_text, value) for values kept by the caller,
+    such as the response cache's hit and miss counts.
+    """
+    lines = []
+    for metric in (REQUEST_LATENCY, STAGE_LATENCY, RESPONSES, DB_QUERIES, QUERIES_PER_REQUEST):
+        lines.extend(metric.render())
+    for kind, values in (("counter", counters), ("gauge", gauges)):
+        for name, help_text, value in values:
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"])
+    return "\n".join(lines) + "\n"
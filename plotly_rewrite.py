@@ -1,9 +1,16 @@
 #!/usr/bin/env python3
 import argparse
-import sqlite3
 import json
 import plotly.graph_objects as go
-import numpy as np
+from plotly.subplots import make_subplots
+import locus_db
+import metrics
+from allele_filter import filter_allele_dicts
+
+
+# Thresholds used by the web app when a request doesn't override them; plots
+# for these are precomputed into locus_default_plot by scripts/materialize_plots.py.
+DEFAULT_COUNT_THRESHOLD = 100
 
 
 def parse_float_or_nan(x):
@@ -15,104 +22,215 @@ def parse_float_or_nan(x):
 
 def query_allele_data(db_path, repeat_id):
     """
-    Queries the SQLite database for allele data using repeat_id.
+    Queries the SQLite database for allele data using repeat_id, on a pooled
+    read-only connection. A repeat_id with several phenotypes resolves to the
+    alphabetically first one (locus_db.FIRST_LOCUS_BY_REPEAT_ID_SQL).
+    The allele rows are read as typed numbers from locus_alleles in one
+    range scan, ordered by summed length.
     """
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-
-    cur.execute("SELECT data_json FROM locus_data WHERE repeat_id = ?", (repeat_id,))
-    result = cur.fetchone()
-    conn.close()
-
-    if not result:
+    with metrics.stage("sqlite"), locus_db.read_connection(db_path) as conn:
+        rows = conn.execute(
+            f"""
+            SELECT summed_length, sample_count, mean, ci_low, ci_high
+            FROM locus_alleles
+            WHERE locus_id = ({locus_db.FIRST_LOCUS_BY_REPEAT_ID_SQL})
+            ORDER BY summed_length
+        """,
+            (repeat_id,),
+        ).fetchall()
+
+    if not rows:
         print(f"[WARNING] No data found for repeat_id: {repeat_id}")
         return None, None, None
 
-    data = json.loads(result[0])
+    with metrics.stage("decode"):
+        return locus_db.allele_dicts(rows)
 
-    # Extract relevant fields
-    dosage_dict = json.loads(data.get("sample_count_per_summed_length", "{}"))
-    mean_col_name = next((c for c in data.keys() if c.startswith("mean_")), None)
-    mean_dict = json.loads(data.get(mean_col_name, "{}")) if mean_col_name else {}
-    ci_dict = json.loads(data.get("summed_length_0.05_alpha_CI", "{}"))
 
-    return dosage_dict, mean_dict, ci_dict
+def query_default_plot_json(db_path, repeat_id):
+    """
+    Returns the precomputed Plotly JSON for repeat_id at the default
+    thresholds, or None if it hasn't been materialized. Picks the same locus
+    as query_allele_data().
+    """
+    with metrics.stage("sqlite"), locus_db.read_connection(db_path) as conn:
+        row = conn.execute(
+            f"""
+            SELECT plot_json FROM locus_default_plot
+            WHERE locus_id = ({locus_db.FIRST_LOCUS_BY_REPEAT_ID_SQL})
+        """,
+            (repeat_id,),
+        ).fetchone()
+    return row[0] if row else None
+
+
+def series_from_dicts(dosage_dict, mean_dict, ci_dict):
+    """
+    Returns the filtered allele data as sorted, aligned lists:
+    {"x": [...], "mean": [...], "ci_low": [...], "ci_high": [...]}.
+    """
+    sorted_alleles = sorted(dosage_dict.keys(), key=float)
+    return {
+        "x": [float(a) for a in sorted_alleles],
+        "mean": [parse_float_or_nan(mean_dict[a]) for a in sorted_alleles],
+        "ci_low": [parse_float_or_nan(ci_dict[a][0]) for a in sorted_alleles],
+        "ci_high": [parse_float_or_nan(ci_dict[a][1]) for a in sorted_alleles],
+    }
+
+
+def query_plot_series(
+    db_path,
+    repeat_id,
+    count_threshold=DEFAULT_COUNT_THRESHOLD,
+    max_ci_range=None,
+    max_relative_ci_range=None,
+):
+    """
+    Returns [(phenotype, series)] for every phenotype of repeat_id, where
+    series is the filtered output of series_from_dicts(). At the default
+    thresholds the precomputed series are used when every locus has one.
+    """
+    if count_threshold == DEFAULT_COUNT_THRESHOLD and max_ci_range is None and max_relative_ci_range is None:
+        with metrics.stage("sqlite"), locus_db.read_connection(db_path) as conn:
+            rows = conn.execute(
+                """
+                SELECT l.phenotype, p.series_json
+                FROM locus_data l LEFT JOIN locus_default_plot p ON p.locus_id = l.id
+                WHERE l.repeat_id = ?
+                ORDER BY l.phenotype
+            """,
+                (repeat_id,),
+            ).fetchall()
+        if rows and all(series_json is not None for _, series_json in rows):
+            with metrics.stage("decode"):
+                return [(phenotype, json.loads(series_json)) for phenotype, series_json in rows]
+
+    return [
+        (
+            phenotype,
+            series_from_dicts(
+                *filter_allele_data(
+                    dosage_dict, mean_dict, ci_dict, count_threshold, max_ci_range, max_relative_ci_range
+                )
+            ),
+        )
+        for phenotype, dosage_dict, mean_dict, ci_dict in query_allele_data_batch(db_path, [repeat_id]).get(repeat_id, [])
+    ]
+
+
+def query_allele_data_batch(db_path, repeat_ids, phenotype=None):
+    """
+    Queries allele data for every phenotype of one or many repeat_ids in a
+    single query. Returns {repeat_id: [(phenotype, dosage_dict, mean_dict, ci_dict), ...]}
+    with phenotypes in alphabetical order; repeat_ids without data are absent.
+    """
+    results = {}
+    with metrics.stage("sqlite"), locus_db.read_connection(db_path) as conn:
+        for locus, dosage_dict, mean_dict, ci_dict in locus_db.iter_allele_series(
+            conn, phenotype=phenotype, repeat_ids=list(repeat_ids)
+        ):
+            results.setdefault(locus["repeat_id"], []).append(
+                (locus["phenotype"], dosage_dict, mean_dict, ci_dict)
+            )
+    return results
 
 
 def filter_allele_data(dosage_dict, mean_dict, ci_dict, count_threshold, max_ci_range, max_relative_ci_range):
     """
     Applies threshold-based filtering to allele data.
+    The masks are evaluated as array operations by allele_filter.
     """
-    filtered_dosage = {}
-    filtered_mean = {}
-    filtered_ci = {}
-
-    for allele in dosage_dict.keys():
-        count_val = parse_float_or_nan(dosage_dict[allele])
-        if count_val < count_threshold:
-            continue
-
-        lower = parse_float_or_nan(ci_dict.get(allele, [None, None])[0])
-        upper = parse_float_or_nan(ci_dict.get(allele, [None, None])[1])
-        mean_val = parse_float_or_nan(mean_dict.get(allele, None))
-
-        if np.isnan(lower) or np.isnan(upper) or np.isnan(mean_val):
-            continue
-
-        # Apply CI filtering
-        if max_ci_range is not None and (upper - lower) > max_ci_range:
-            continue
-        if max_relative_ci_range is not None and ((upper - lower) / mean_val) > max_relative_ci_range:
-            continue
-
-        filtered_dosage[allele] = dosage_dict[allele]
-        filtered_mean[allele] = mean_dict[allele]
-        filtered_ci[allele] = ci_dict[allele]
-
-    return filtered_dosage, filtered_mean, filtered_ci
-
-
-def generate_figure_plotly(dosage_dict, mean_dict, ci_dict):
+    with metrics.stage("filter"):
+        return filter_allele_dicts(
+            dosage_dict,
+            mean_dict,
+            ci_dict,
+            count_threshold=count_threshold,
+            max_ci_range=max_ci_range,
+            max_relative_ci_range=max_relative_ci_range,
+        )
+
+
+def allele_trace_plotly(dosage_dict, mean_dict, ci_dict, showlegend=None):
     """
-    Creates a Plotly figure using the processed allele data.
-    Defaults to black & white (B/W) with error bars.
+    Builds the black & white mean-with-error-bars trace for one locus.
+    Returns None if there are no alleles.
     """
     sorted_alleles = sorted(dosage_dict.keys(), key=float)
     if not sorted_alleles:
-        print("[ERROR] No valid allele data found.")
         return None
 
     ci_lower = [ci_dict.get(str(a), [None, None])[0] for a in sorted_alleles]
     ci_upper = [ci_dict.get(str(a), [None, None])[1] for a in sorted_alleles]
     mean_vals = [mean_dict.get(str(a), None) for a in sorted_alleles]
 
-    fig = go.Figure()
-
     # ✅ Default to Black & White (B/W) error bars
     error_y = [ci_upper[i] - mean_vals[i] for i in range(len(sorted_alleles))]
     error_y_minus = [mean_vals[i] - ci_lower[i] for i in range(len(sorted_alleles))]
-    fig.add_trace(go.Scatter(
+    return go.Scatter(
         x=sorted_alleles, y=mean_vals, mode="lines+markers",
         error_y=dict(type="data", array=error_y, arrayminus=error_y_minus, visible=True),
-        line=dict(color="black", width=3), marker=dict(color="black", size=8), name="95% CI"
-    ))
-
-    fig.update_layout(
-        xaxis_title="Sum of allele lengths (repeat copies)",
-        yaxis_title="Phenotype Value",
-        showlegend=True
+        line=dict(color="black", width=3), marker=dict(color="black", size=8), name="95% CI",
+        showlegend=showlegend
     )
 
+
+def generate_figure_plotly(dosage_dict, mean_dict, ci_dict):
+    """
+    Creates a Plotly figure using the processed allele data.
+    Defaults to black & white (B/W) with error bars.
+    """
+    with metrics.stage("figure"):
+        trace = allele_trace_plotly(dosage_dict, mean_dict, ci_dict)
+        if trace is None:
+            print("[ERROR] No valid allele data found.")
+            return None
+
+        fig = go.Figure()
+        fig.add_trace(trace)
+
+        fig.update_layout(
+            xaxis_title="Sum of allele lengths (repeat copies)",
+            yaxis_title="Phenotype Value",
+            showlegend=True
+        )
+
     return fig
 
 
+def generate_faceted_figure_plotly(facets):
+    """
+    Creates one Plotly figure with a subplot per facet.
+    `facets` is a list of (title, dosage_dict, mean_dict, ci_dict); facets
+    with no alleles left are dropped. Returns None if nothing remains.
+    """
+    facets = [f for f in facets if f[1]]
+    if not facets:
+        print("[ERROR] No valid allele data found.")
+        return None
+
+    with metrics.stage("figure"):
+        fig = make_subplots(
+            rows=len(facets), cols=1, subplot_titles=[f[0] for f in facets],
+            vertical_spacing=min(0.08, 0.3 / len(facets))
+        )
+        for row, (_, dosage_dict, mean_dict, ci_dict) in enumerate(facets, start=1):
+            fig.add_trace(allele_trace_plotly(dosage_dict, mean_dict, ci_dict, showlegend=row == 1), row=row, col=1)
+            fig.update_yaxes(title_text="Phenotype Value", row=row, col=1)
+        fig.update_xaxes(title_text="Sum of allele lengths (repeat copies)", row=len(facets), col=1)
+
+        fig.update_layout(height=max(450, 300 * len(facets)), showlegend=True)
+
+        return fig
+
+
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--db-path", required=True, help="Path to the SQLite database file.")
     parser.add_argument("--repeat-id", required=True, help="Repeat ID to query.")
     parser.add_argument("--output-dir", required=True, help="Directory to save the output.")
-    parser.add_argument("--count-threshold", type=float, default=100, help="Minimum allele count threshold.")
+    parser.add_argument("--count-threshold", type=float, default=DEFAULT_COUNT_THRESHOLD, help="Minimum allele count threshold.")
     parser.add_argument("--max-ci-range", type=float, default=None, help="Max absolute CI range.")
     parser.add_argument("--max-relative-ci-range", type=float, default=None, help="Max relative CI range.")
 
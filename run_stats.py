@@ -0,0 +1,163 @@
+"""
+Shared --profile and --stats options for the batch scripts (import_to_db.py,
+plotting_rewrite.py, scan_blessed_set.py). stage() adds the enclosed block's
+wall time to a named stage, count_file() tallies files and bytes read, and
+session() wraps a run: with --stats it prints per-stage wall time, files/sec,
+bytes read and peak RSS at the end; with --profile it runs the whole thing
+under cProfile and writes the stats to a file. Both are off by default, and
+a disabled stage() is a single flag check.
+
+Stage times are measured in the main process. With --jobs > 1 the stage that
+waits on the worker pool shows how long the main process was blocked on it,
+and cProfile only sees the main process; for a sampling flamegraph that
+includes the workers, run the script under
+`py-spy record --subprocesses --format speedscope -o run.json -- python ...`.
+"""
+import cProfile
+import pstats
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Functions listed after a --profile run, by cumulative time.
+PROFILE_TOP_N = 25
+
+_enabled = False
+_stages = {}
+_files = 0
+_bytes_read = 0
+
+
+def add_arguments(parser):
+    """Add --profile and --stats to an argparse parser."""
+    parser.add_argument(
+        "--profile",
+        default=None,
+        metavar="PATH",
+        help="Run under cProfile and write the stats to PATH (load with pstats, snakeviz or flameprof).",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        default=False,
+        help="Print per-stage wall time, files/sec, bytes read and peak RSS at the end of the run.",
+    )
+
+
+@contextmanager
+def stage(name):
+    """Add the enclosed block's wall time to stage `name`."""
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - start)
+
+
+def _record(name, seconds):
+    entry = _stages.setdefault(name, [0.0, 0])
+    entry[0] += seconds
+    entry[1] += 1
+
+
+def timed(name, iterable):
+    """Yield from iterable, timing each step as stage `name` (e.g. waiting on a worker pool)."""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        if _enabled:
+            _record(name, time.perf_counter() - start)
+        yield item
+
+
+def count_file(nbytes=0):
+    """Record one processed file and the bytes read from it."""
+    global _files, _bytes_read
+    _files += 1
+    _bytes_read += nbytes
+
+
+def add_bytes(nbytes):
+    """Record bytes read outside a count_file() call (e.g. header reads)."""
+    global _bytes_read
+    _bytes_read += nbytes
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process or any finished child, or None if unavailable."""
+    if resource is None:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in bytes on macOS and in KiB on Linux.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _format_bytes(nbytes):
+    for unit in ("B", "KB", "MB"):
+        if nbytes < 1024:
+            return f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f} GB"
+
+
+def print_summary(elapsed):
+    elapsed = max(elapsed, 1e-9)
+    parts = [f"{elapsed:.2f}s wall", f"{_files} files ({_files / elapsed:.1f} files/sec)"]
+    if _bytes_read:
+        parts.append(f"{_format_bytes(_bytes_read)} read ({_format_bytes(_bytes_read / elapsed)}/s)")
+    peak = peak_rss_bytes()
+    if peak is not None:
+        parts.append(f"peak RSS {_format_bytes(peak)}")
+    print(f"[STATS] {', '.join(parts)}")
+
+    width = max((len(name) for name in _stages), default=0)
+    for name, (seconds, calls) in sorted(_stages.items(), key=lambda kv: -kv[1][0]):
+        print(
+            f"[STATS]   {name:<{width}}  {seconds:8.2f}s  {100 * seconds / elapsed:5.1f}%  ({calls} calls)"
+        )
+
+
+@contextmanager
+def session(args):
+    """
+    Run the enclosed block with the profiling options from add_arguments().
+    The summary and profile are written even if the block raises.
+    """
+    global _enabled, _files, _bytes_read
+    _enabled = args.stats
+    _stages.clear()
+    _files = _bytes_read = 0
+    profiler = cProfile.Profile() if args.profile else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        elapsed = time.perf_counter() - start
+        if profiler is not None:
+            profiler.dump_stats(args.profile)
+            print(f"[INFO] Wrote cProfile stats to {args.profile}; top {PROFILE_TOP_N} by cumulative time:")
+            pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+            if getattr(args, "jobs", 1) > 1:
+                print("[INFO] --profile only covers the main process; worker processes are not profiled.")
+        if args.stats:
+            print_summary(elapsed)
+        _enabled = False
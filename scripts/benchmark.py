@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmarks for the import, query, filter and render hot paths.
+
+For each scale (a multiple of the 498 loci in the shipped locus_data.db) a
+synthetic directory of phenotype/locus_N.tab files is generated, imported
+with import_to_db.process_directory, and then a sample of repeat_ids is
+pushed through query_allele_data, both filter_allele_data variants,
+generate_figure_plotly, generate_figure_matplotlib and the /test_locus
+route (via Flask's test client). Results are written as JSON; pass
+--compare with an earlier results file to flag regressions.
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import import_to_db
+import plotting_rewrite
+import plotly_rewrite
+import flask_test
+
+BASE_ROWS = 498
+DEFAULT_SCALES = [1, 10, 100]
+
+# Shape of the real data: ~5 phenotypes per STR site, 4-39 single-allele
+# lengths per site (so ~7-77 summed lengths), ~160k samples per locus.
+PHENOTYPES_PER_SITE = 5
+N_SAMPLES = 161743
+PHENOTYPES = [
+    "alanine_aminotransferase", "albumin", "alkaline_phosphatase", "apolipoprotein_a",
+    "apolipoprotein_b", "aspartate_aminotransferase", "calcium", "cholesterol",
+    "c_reactive_protein", "creatinine", "cystatin_c", "eosinophil_count",
+    "glucose", "glycated_haemoglobin", "haematocrit", "haemoglobin_concentration",
+    "hdl_cholesterol", "igf_1", "ldl_cholesterol_direct", "lymphocyte_count",
+    "corpuscular_haemoglobin", "corpuscular_volume", "monocyte_count", "neutrophil_count",
+    "phosphate", "platelet_count", "red_blood_cell_count", "shbg",
+    "total_bilirubin", "total_protein", "triglycerides", "urate",
+    "urea", "vitamin_d", "white_blood_cell_count", "sphered_cell_volume",
+]
+
+TAB_COLUMNS = [
+    "chrom", "pos", "alleles", "n_samples_tested", "locus_filtered",
+    "p_{trait}", "coeff_{trait}", "se_{trait}", "regression_R^2", "motif",
+    "period", "ref_len", "allele_frequency", "sample_count_per_summed_length",
+    "mean_{trait}_per_summed_length", "summed_length_0.05_alpha_CI",
+]
+
+
+def synthetic_locus(rng, trait, chrom, pos, period, ref_len, n_single):
+    """One .tab row (as a list, in TAB_COLUMNS order) with plausible allele statistics."""
+    single = [float(ref_len - n_single // 2 + i) for i in range(n_single)]
+    weights = [math.exp(-0.5 * ((i - n_single / 2) / max(n_single / 5, 1)) ** 2) for i in range(n_single)]
+    total = sum(weights)
+    freqs = [w / total for w in weights]
+
+    baseline = rng.uniform(1, 100)
+    coeff = rng.gauss(0, 0.02)
+    sd = baseline * 0.2
+    counts, means, cis = {}, {}, {}
+    for i in range(n_single):
+        for j in range(i, n_single):
+            key = str(single[i] + single[j])
+            p = freqs[i] * freqs[j] * (1 if i == j else 2)
+            counts[key] = counts.get(key, 0) + max(1, int(N_SAMPLES * p))
+    for key, count in counts.items():
+        mean = baseline + coeff * (float(key) - 2 * ref_len) + rng.gauss(0, sd / math.sqrt(count))
+        means[key] = mean
+        if count < 2:
+            cis[key] = ["NaN", "NaN"]
+        else:
+            half = 1.96 * sd / math.sqrt(count)
+            cis[key] = [mean - half, mean + half]
+
+    p_value = 10 ** -rng.uniform(1, 30)
+    return [
+        chrom, pos, ",".join(str(a) for a in single), N_SAMPLES, "False",
+        p_value, coeff, abs(coeff) / 5 + 1e-4, rng.uniform(0, 0.01), "".join(rng.choice("ACGT") for _ in range(period)),
+        period, float(ref_len), json.dumps({str(a): f"{f:.2g}" for a, f in zip(single, freqs)}),
+        json.dumps(counts), json.dumps(means), json.dumps(cis),
+    ]
+
+
+def generate_tab_files(out_dir, n_loci, seed=0):
+    """
+    Write n_loci synthetic .tab files as {out_dir}/{phenotype}/locus_{i}.tab.
+    Returns {(chrom, pos): repeat_id} for labelling the imported database.
+    """
+    rng = random.Random(seed)
+    sites = {}
+    written = 0
+    site = 0
+    while written < n_loci:
+        chrom = f"chr{rng.randint(1, 22)}"
+        pos = rng.randint(1_000_000, 240_000_000)
+        if (chrom, pos) in sites:
+            continue
+        sites[(chrom, pos)] = str(1_000_000 + site)
+        site += 1
+        period = rng.choice([1, 1, 1, 1, 1, 2, 3, 5])
+        ref_len = rng.randint(8, 30)
+        n_single = min(39, 4 + int(rng.expovariate(1 / 6)))
+        for trait in rng.sample(PHENOTYPES, PHENOTYPES_PER_SITE):
+            if written >= n_loci:
+                break
+            row = synthetic_locus(rng, trait, chrom, pos, period, ref_len, n_single)
+            phenotype_dir = os.path.join(out_dir, trait)
+            os.makedirs(phenotype_dir, exist_ok=True)
+            with open(os.path.join(phenotype_dir, f"locus_{written}.tab"), "w", newline="") as f:
+                writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+                writer.writerow([c.format(trait=trait) for c in TAB_COLUMNS])
+                writer.writerow(row)
+            written += 1
+    return sites
+
+
+def summarize(durations):
+    """Timing summary for a list of per-call durations in seconds."""
+    ordered = sorted(durations)
+    n = len(ordered)
+    total = sum(ordered)
+    return {
+        "n": n,
+        "total_s": round(total, 6),
+        "mean_ms": round(1e3 * total / n, 4),
+        "p50_ms": round(1e3 * ordered[n // 2], 4),
+        "p95_ms": round(1e3 * ordered[min(n - 1, int(0.95 * n))], 4),
+    }
+
+
+def time_calls(fn, items):
+    durations = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        durations.append(time.perf_counter() - start)
+    return summarize(durations)
+
+
+def benchmark_scale(work_dir, scale, samples, jobs, seed):
+    n_loci = BASE_ROWS * scale
+    tab_dir = os.path.join(work_dir, f"tabs_{scale}x")
+    db_path = os.path.join(work_dir, f"locus_{scale}x.db")
+    results = {"loci": n_loci}
+
+    start = time.perf_counter()
+    sites = generate_tab_files(tab_dir, n_loci, seed)
+    results["generate_s"] = round(time.perf_counter() - start, 3)
+
+    # Import from scratch, then re-import with nothing changed.
+    conn = import_to_db.create_db(db_path)
+    for name in ("import", "import (unchanged)"):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            import_to_db.process_directory(tab_dir, conn, jobs=jobs)
+        elapsed = time.perf_counter() - start
+        results[name] = {**summarize([elapsed]), "files_per_sec": round(n_loci / elapsed, 1)}
+
+    with conn:
+        conn.executemany(
+            "UPDATE locus_data SET repeat_id = ? WHERE chrom = ? AND pos = ?",
+            ((rid, chrom, pos) for (chrom, pos), rid in sites.items()),
+        )
+    conn.close()
+
+    repeat_ids = random.Random(seed).sample(sorted(sites.values()), min(samples, len(sites)))
+    results["query_allele_data"] = time_calls(
+        lambda rid: plotly_rewrite.query_allele_data(db_path, rid), repeat_ids
+    )
+    loci = [plotly_rewrite.query_allele_data(db_path, rid) for rid in repeat_ids]
+
+    results["filter_allele_data (plotly_rewrite)"] = time_calls(
+        lambda locus: plotly_rewrite.filter_allele_data(*locus, plotly_rewrite.DEFAULT_COUNT_THRESHOLD, None, None),
+        loci,
+    )
+    results["filter_allele_data (plotting_rewrite)"] = time_calls(
+        lambda locus: plotting_rewrite.filter_allele_data(*locus, count_threshold=plotly_rewrite.DEFAULT_COUNT_THRESHOLD),
+        loci,
+    )
+    filtered = [
+        plotly_rewrite.filter_allele_data(*locus, plotly_rewrite.DEFAULT_COUNT_THRESHOLD, None, None)
+        for locus in loci
+    ]
+    with contextlib.redirect_stdout(io.StringIO()):
+        results["generate_figure_plotly"] = time_calls(
+            lambda locus: plotly_rewrite.generate_figure_plotly(*locus), filtered
+        )
+    template = plotting_rewrite._get_figure_template()
+    results["generate_figure_matplotlib"] = time_calls(
+        lambda locus: plotting_rewrite.generate_figure_matplotlib(*locus, "glucose", fig_ax=template),
+        filtered,
+    )
+
+    app = flask_test.create_app(db_path)
+    client = app.test_client()
+
+    def get_test_locus(rid):
+        response = client.get(f"/test_locus?repeat_id={rid}")
+        response.close()
+
+    def get_test_locus_cold(rid):
+        app.extensions["locus"].response_cache.clear()
+        get_test_locus(rid)
+
+    results["/test_locus"] = time_calls(get_test_locus_cold, repeat_ids)
+    for rid in repeat_ids:
+        get_test_locus(rid)
+    results["/test_locus (cached)"] = time_calls(get_test_locus, repeat_ids)
+
+    shutil.rmtree(tab_dir)
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(baseline, current, metric="p50_ms", threshold=0.10):
+    """
+    Print each benchmark's change in `metric` from baseline to current.
+    Returns the list of (scale, name, ratio) that got slower by more than threshold.
+    """
+    regressions = []
+    print(f"{'scale':>6}  {'benchmark':<40} {'baseline':>12} {'current':>12} {'change':>8}")
+    for scale, results in current["results"].items():
+        for name, stats in results.items():
+            old = baseline["results"].get(scale, {}).get(name)
+            if not isinstance(stats, dict) or not isinstance(old, dict) or not old.get(metric):
+                continue
+            ratio = stats[metric] / old[metric]
+            flag = ""
+            if ratio > 1 + threshold:
+                regressions.append((scale, name, ratio))
+                flag = "  REGRESSION"
+            print(f"{scale:>6}  {name:<40} {old[metric]:>12.3f} {stats[metric]:>12.3f} {ratio - 1:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark import, query, filter and render on synthetic data at several scales"
+    )
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SCALES,
+        help=f"Multiples of {BASE_ROWS} loci to benchmark (default: 1 10 100).",
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=100,
+        help="repeat_ids sampled per scale for the per-locus benchmarks (default: 100).",
+    )
+    parser.add_argument("--jobs", type=int, default=1, help="Worker processes for the import (default: 1).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic data (default: 0).")
+    parser.add_argument("--output", default=None, help="Write results JSON here (default: stdout).")
+    parser.add_argument("--work-dir", default=None, help="Where to generate data (default: a temporary directory).")
+    parser.add_argument(
+        "--compare",
+        default=None,
+        help="Baseline results JSON; print the change per benchmark and exit 1 on regressions.",
+    )
+    parser.add_argument(
+        "--current",
+        default=None,
+        help="With --compare: compare this existing results JSON instead of running the benchmarks.",
+    )
+    parser.add_argument(
+        "--metric",
+        choices=["mean_ms", "p50_ms", "p95_ms", "total_s"],
+        default="p50_ms",
+        help="Statistic compared by --compare (default: p50_ms).",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="Relative slowdown that counts as a regression (default: 0.10).",
+    )
+    args = parser.parse_args()
+
+    if args.current:
+        with open(args.current) as f:
+            current = json.load(f)
+    else:
+        work_dir = args.work_dir or tempfile.mkdtemp(prefix="locus_bench_")
+        current = {"environment": environment(), "samples": args.samples, "seed": args.seed, "results": {}}
+        try:
+            for scale in args.scales:
+                print(f"[INFO] Benchmarking {scale}x ({BASE_ROWS * scale} loci)...", file=sys.stderr)
+                current["results"][f"{scale}x"] = benchmark_scale(work_dir, scale, args.samples, args.jobs, args.seed)
+        finally:
+            if args.work_dir is None:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        text = json.dumps(current, indent=2)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(text + "\n")
+            print(f"Saved benchmark results to {args.output}", file=sys.stderr)
+        elif not args.compare:
+            print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, current, args.metric, args.threshold)
+        if regressions:
+            print(f"[WARNING] {len(regressions)} benchmarks slowed down by more than {args.threshold:.0%}.")
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
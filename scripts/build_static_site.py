@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import locus_db
+import plotly
+from plotly.offline import get_plotlyjs
+from flask import render_template
+from flask_test import app
+from plotly_rewrite import DEFAULT_COUNT_THRESHOLD, filter_allele_data, generate_figure_plotly
+
+MANIFEST_NAME = ".build_manifest.json"
+PLOTLY_BUNDLE_NAME = "plotly.min.js"
+TEMPLATE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "templates",
+    "flask_html_test.html",
+)
+
+
+def page_relpath(repeat_id, phenotype):
+    """Pages live at {repeat_id}/{phenotype}.html under the output directory."""
+    return os.path.join(str(repeat_id), f"{phenotype}.html")
+
+
+def build_fingerprint():
+    """Changes whenever the page template or the Plotly version changes, forcing a full rebuild."""
+    with open(TEMPLATE_PATH, "rb") as f:
+        template_hash = hashlib.sha1(f.read()).hexdigest()
+    return f"{template_hash}:{plotly.__version__}:{DEFAULT_COUNT_THRESHOLD}"
+
+
+def locus_fingerprint(locus, dosage_dict, mean_dict, ci_dict):
+    """Hash of everything a page is rendered from."""
+    content = repr((locus["repeat_id"], locus["phenotype"], dosage_dict, mean_dict, ci_dict))
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def render_page(task):
+    """
+    Worker: render one (repeat_id, phenotype) page at the default
+    thresholds and write it. Returns (relpath, error message or None).
+    """
+    output_dir, relpath, locus, dosage_dict, mean_dict, ci_dict = task
+    try:
+        dosage_dict, mean_dict, ci_dict = filter_allele_data(
+            dosage_dict, mean_dict, ci_dict, DEFAULT_COUNT_THRESHOLD, None, None
+        )
+        fig = generate_figure_plotly(dosage_dict, mean_dict, ci_dict)
+        # Pages sit one directory below the shared Plotly bundle.
+        with app.app_context():
+            body = render_template(
+                "flask_html_test.html",
+                gwas_plot_json=fig.to_json() if fig is not None else None,
+                repeat_id=locus["repeat_id"],
+                phenotype=locus["phenotype"],
+                plotly_js_src=f"../{PLOTLY_BUNDLE_NAME}",
+            )
+        output_path = os.path.join(output_dir, relpath)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        tmp_path = output_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(body)
+        os.replace(tmp_path, output_path)
+    except Exception as e:
+        return relpath, f"[ERROR] Could not render {relpath}: {e}"
+    return relpath, None
+
+
+def write_plotly_bundle(output_dir):
+    """Write the Plotly.js bundle shared by every page, if it changed."""
+    bundle = get_plotlyjs()
+    bundle_path = os.path.join(output_dir, PLOTLY_BUNDLE_NAME)
+    if os.path.exists(bundle_path):
+        with open(bundle_path, "r", encoding="utf-8") as f:
+            if f.read() == bundle:
+                return
+    with open(bundle_path, "w", encoding="utf-8") as f:
+        f.write(bundle)
+
+
+def build_site(db_path, output_dir, jobs=1, force=False):
+    """
+    Render every (repeat_id, phenotype) page into output_dir. Pages whose
+    locus rows are unchanged since the last build are kept, and pages for
+    loci that are gone are removed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    write_plotly_bundle(output_dir)
+
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    if manifest.get("build") != build_fingerprint():
+        manifest = {"build": build_fingerprint(), "pages": {}}
+    old_pages = manifest["pages"]
+
+    start = time.perf_counter()
+    pages = {}
+    tasks = []
+    conn = locus_db.connect_readonly(db_path)
+    for locus, dosage_dict, mean_dict, ci_dict in locus_db.iter_allele_series(conn):
+        if not locus["repeat_id"]:
+            continue
+        relpath = page_relpath(locus["repeat_id"], locus["phenotype"])
+        fingerprint = locus_fingerprint(locus, dosage_dict, mean_dict, ci_dict)
+        pages[relpath] = fingerprint
+        if old_pages.get(relpath) == fingerprint and os.path.exists(
+            os.path.join(output_dir, relpath)
+        ):
+            continue
+        tasks.append((output_dir, relpath, locus, dosage_dict, mean_dict, ci_dict))
+    conn.close()
+
+    failed = set()
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(render_page, tasks, chunksize=16))
+    else:
+        results = map(render_page, tasks)
+    for relpath, error in results:
+        if error is not None:
+            print(error)
+            failed.add(relpath)
+        else:
+            print(f"Rendered {relpath}")
+
+    removed = 0
+    for relpath in old_pages:
+        if relpath not in pages:
+            path = os.path.join(output_dir, relpath)
+            if os.path.exists(path):
+                os.remove(path)
+                removed += 1
+            print(f"Removed {relpath}")
+
+    manifest["pages"] = {p: f for p, f in pages.items() if p not in failed}
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    print(
+        f"Rendered {len(tasks) - len(failed)} pages ({len(failed)} failed), "
+        f"kept {len(pages) - len(tasks)} unchanged, removed {removed} "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pre-render every locus page in locus_data.db as static HTML"
+    )
+    parser.add_argument(
+        "--db-path", required=True, help="Path to the SQLite database file."
+    )
+    parser.add_argument(
+        "--output-dir",
+        required=True,
+        help="Directory for the static site ({repeat_id}/{phenotype}.html plus one shared plotly.min.js)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes used to render pages (default: 1).",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        default=False,
+        help="Re-render every page even if its rows are unchanged.",
+    )
+    args = parser.parse_args()
+
+    build_site(args.db_path, args.output_dir, jobs=args.jobs, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
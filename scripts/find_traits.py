@@ -1,8 +1,12 @@
 import argparse
 import os
+import sys
 import polars as pl
 import shutil
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import header_index
+
 
 def find_files_with_trait(
     directory, chrom=None, pos=None, trait=None, motif=None, margin=20
@@ -58,6 +62,38 @@ def find_files_with_trait(
     return matching_files
 
 
+def find_files_with_trait_indexed(
+    directory, chrom=None, pos=None, trait=None, motif=None, margin=20, index_path=None
+):
+    """
+    Same matching rules as find_files_with_trait, answered from the header
+    index instead of reopening every file.
+    """
+    matching_files = []
+    headers = header_index.load_headers(directory, index_path)
+
+    for filename in sorted(headers):
+        if os.sep in filename or not filename.endswith(".tab"):
+            continue
+        file_chrom, file_pos, file_motif, cols = headers[filename]
+
+        chrom_match = chrom is None or ("chrom" in cols and file_chrom == chrom)
+        if pos is not None and "pos" in cols:
+            pos_match = file_pos is not None and pos - margin <= file_pos <= pos + margin
+        else:
+            pos_match = pos is None
+        trait_match = trait is None or any(trait.lower() in col.lower() for col in cols)
+        if motif is not None and "motif" in cols:
+            motif_match = file_motif == motif
+        else:
+            motif_match = motif is None
+
+        if chrom_match and pos_match and trait_match and motif_match:
+            matching_files.append((filename, len(cols)))
+
+    return matching_files
+
+
 def copy_files_to_directory(files, source_directory, target_directory):
     """Copy the matching files to a new directory."""
     if not os.path.exists(target_directory):
@@ -89,12 +125,28 @@ def main():
         default=20,
         help="Margin for position matching (default: 20)",
     )
+    parser.add_argument(
+        "--index-path",
+        default=None,
+        help="Answer the search from this header index (built/refreshed by header_index.py) instead of reading every file",
+    )
     args = parser.parse_args()
 
     # Find matching files
-    matching_files = find_files_with_trait(
-        args.directory, args.chrom, args.pos, args.trait, args.motif, args.margin
-    )
+    if args.index_path:
+        matching_files = find_files_with_trait_indexed(
+            args.directory,
+            args.chrom,
+            args.pos,
+            args.trait,
+            args.motif,
+            args.margin,
+            index_path=args.index_path,
+        )
+    else:
+        matching_files = find_files_with_trait(
+            args.directory, args.chrom, args.pos, args.trait, args.motif, args.margin
+        )
 
     # Print the results
     if matching_files:
@@ -1,58 +1,48 @@
 #!/usr/bin/env python3
 import argparse
-import ast
+import contextlib
+import hashlib
 import os
-import json
-import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 import polars as pl
-import re
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import header_index
+import locus_db
+import run_stats
 
 
 def create_db(db_path):
     """
-    Create a SQLite database with a table 'locus_data' if it doesn't exist.
-    """
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS locus_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            phenotype TEXT,
-            chrom TEXT,
-            pos INTEGER,
-            data_json TEXT
-        );
+    Create the locus_data.db schema if it doesn't exist, or upgrade an
+    existing database (including the legacy data_json layout) to the
+    current schema version.
     """
-    )
-    conn.commit()
+    conn = locus_db.connect(db_path)
+    locus_db.upgrade_db(conn)
     return conn
 
 
 def insert_locus_data(conn, phenotype, chrom, pos, data):
     """
-    Insert a row into the locus_data table.
-    The full row data is stored as a JSON string.
+    Insert or update a row in the locus_data table, keyed on (phenotype, chrom, pos).
+    Typed locus fields go into locus_data and the per-allele dicts are
+    unpacked into the locus_alleles / locus_allele_frequency child tables.
     """
-    cur = conn.cursor()
-    data_json = json.dumps(data)
-    cur.execute(
-        """
-        INSERT INTO locus_data (phenotype, chrom, pos, data_json)
-        VALUES (?, ?, ?, ?)
-    """,
-        (phenotype, chrom, pos, data_json),
-    )
+    locus_db.upsert_locus_records(conn, [locus_db.locus_record(phenotype, data)])
     conn.commit()
 
 
-def process_file(filepath):
+def process_file(filepath, content=None):
     """
     Reads a .tab file using Polars, extracts the single row (if present),
     and returns a dictionary containing the data.
+    If the file's bytes were already read, pass them as `content`.
     """
     try:
-        df = pl.read_csv(filepath, separator="\t")
+        df = pl.read_csv(filepath if content is None else content, separator="\t")
     except Exception as e:
         print(f"[ERROR] Could not read {filepath}: {e}")
         return None
@@ -73,25 +63,182 @@ def process_file(filepath):
     return {"chrom": chrom, "pos": pos, "data": row}
 
 
-def process_directory(input_dir, conn):
+def find_tab_files(input_dir, index_path=None):
     """
-    Recursively process all .tab files in the given directory.
+    Recursively list (filepath, phenotype) for every .tab file under input_dir.
     For files located in a subdirectory, the immediate subdirectory name is used as the phenotype.
+    With index_path, the listing comes from the persistent header index and
+    files without a chrom/pos data row are left out without being opened.
     """
+    if index_path:
+        headers = header_index.load_headers(input_dir, index_path)
+        tab_files = []
+        for relpath in sorted(headers):
+            chrom, pos = headers[relpath][:2]
+            if not relpath.endswith(".tab") or chrom is None or pos is None:
+                continue
+            filepath = os.path.join(input_dir, relpath)
+            tab_files.append((filepath, os.path.basename(os.path.dirname(filepath))))
+        return tab_files
+
+    tab_files = []
     for root, dirs, files in os.walk(input_dir):
         # Use the last part of the current root as the phenotype.
         # (If you want to override this based on header information, you can add that logic.)
         phenotype = os.path.basename(root)
-        for file in files:
+        for file in sorted(files):
             if file.endswith(".tab"):
-                filepath = os.path.join(root, file)
-                result = process_file(filepath)
-                if result is None:
+                tab_files.append((os.path.join(root, file), phenotype))
+    return tab_files
+
+
+def parse_locus_file(task):
+    """
+    Worker for import_files: hash one .tab file and, if its content differs
+    from the manifest, split it into a typed locus record.
+    Returns (filepath, phenotype, size, mtime_ns, content_hash, record);
+    record is None when the file is unchanged or could not be parsed, and
+    size, mtime_ns and content_hash are None too if reading it failed.
+    """
+    filepath, phenotype, known_hash = task
+    try:
+        stat = os.stat(filepath)
+        with open(filepath, "rb") as f:
+            content = f.read()
+        content_hash = hashlib.sha256(content).hexdigest()
+        record = None
+        if content_hash != known_hash:
+            result = process_file(filepath, content)
+            if result is not None:
+                record = locus_db.locus_record(phenotype, result["data"])
+    except Exception as e:
+        print(f"[ERROR] Could not import {filepath}: {e}")
+        return filepath, phenotype, None, None, None, None
+    return filepath, phenotype, stat.st_size, stat.st_mtime_ns, content_hash, record
+
+
+def import_files(conn, tab_files, jobs=1, batch_size=5000, prune_under=None):
+    """
+    Incrementally import (filepath, phenotype) pairs.
+
+    Files whose size and mtime match the import manifest are skipped without
+    being read; the rest are hashed, and only files whose content changed
+    are parsed (by a pool of `jobs` worker processes) and upserted on
+    (phenotype, chrom, pos) in transactions of `batch_size` loci. If
+    `prune_under` is a directory, loci imported from files below it that no
+    longer exist are deleted.
+    """
+    tab_files = [(os.path.abspath(f), phenotype) for f, phenotype in tab_files]
+    with run_stats.stage("manifest"):
+        if prune_under is not None:
+            manifest = locus_db.load_manifest(conn, os.path.abspath(prune_under))
+        else:
+            manifest = {}
+            for filepath, _ in tab_files:
+                manifest.update(locus_db.load_manifest(conn, filepath))
+    start = time.perf_counter()
+
+    pending = []
+    n_skipped = 0
+    with run_stats.stage("stat"):
+        for filepath, phenotype in tab_files:
+            known = manifest.get(filepath)
+            if known is not None:
+                stat = os.stat(filepath)
+                if (stat.st_size, stat.st_mtime_ns) == tuple(known[:2]):
+                    n_skipped += 1
+                    run_stats.count_file()
                     continue
-                insert_locus_data(
-                    conn, phenotype, result["chrom"], result["pos"], result["data"]
-                )
-                print(f"Inserted data from {filepath} under phenotype '{phenotype}'")
+            pending.append((filepath, phenotype, known[2] if known else None))
+
+    n_files = n_loci = n_alleles = n_deleted = n_failed = 0
+    batch = []
+    touched = []
+
+    def flush():
+        nonlocal n_loci, n_alleles, n_deleted
+        with run_stats.stage("write"), conn:
+            locus_ids, alleles = locus_db.upsert_locus_records(
+                conn, [record for *_, record in batch]
+            )
+            locus_db.record_manifest(
+                conn,
+                [entry[:4] + (i,) for entry, i in zip(batch, locus_ids)]
+                + [entry[:4] + (manifest[entry[0]][3],) for entry in touched],
+            )
+            # A file edited to a new chrom/pos now points at a different locus;
+            # drop the old one unless another file still points at it.
+            replaced = {
+                manifest[entry[0]][3]
+                for entry, i in zip(batch, locus_ids)
+                if entry[0] in manifest and manifest[entry[0]][3] not in (None, i)
+            }
+            n_deleted += locus_db.delete_orphaned_loci(conn, replaced)
+        n_loci += len(locus_ids)
+        n_alleles += alleles
+        for filepath, _, _, _, phenotype, _ in batch:
+            print(f"Inserted data from {filepath} under phenotype '{phenotype}'")
+        batch.clear()
+        touched.clear()
+
+    with locus_db.bulk_load(conn), contextlib.ExitStack() as stack:
+        if jobs > 1:
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=jobs))
+            chunksize = max(1, min(64, len(pending) // (jobs * 4) or 1))
+            results = pool.map(parse_locus_file, pending, chunksize=chunksize)
+        else:
+            results = map(parse_locus_file, pending)
+
+        # "parse" is read + hash + parse, or the wait for it with --jobs > 1.
+        for filepath, phenotype, size, mtime_ns, content_hash, record in run_stats.timed("parse", results):
+            n_files += 1
+            if content_hash is None:
+                n_failed += 1
+                continue
+            run_stats.count_file(size)
+            if record is not None:
+                batch.append((filepath, size, mtime_ns, content_hash, phenotype, record))
+            elif filepath in manifest and content_hash == manifest[filepath][2]:
+                # Touched but unchanged: refresh size/mtime so the next run skips it.
+                touched.append((filepath, size, mtime_ns, content_hash))
+            if len(batch) + len(touched) >= batch_size:
+                flush()
+
+        if prune_under is not None:
+            present = {f for f, _ in tab_files}
+            gone = [p for p in manifest if p not in present]
+            with run_stats.stage("prune"), conn:
+                n_deleted += locus_db.forget_sources(conn, gone)
+            for p in gone:
+                print(f"Removed {p} (source file no longer exists)")
+        flush()
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(
+        f"Imported {n_loci} loci ({n_alleles} allele rows) from {n_files} changed files "
+        f"in {elapsed:.1f}s: {n_files / elapsed:.1f} files/sec, "
+        f"{(n_loci + n_alleles) / elapsed:.1f} rows/sec; "
+        f"{n_skipped} unchanged files skipped, {n_deleted} loci deleted"
+    )
+    if n_failed:
+        print(f"[WARNING] {n_failed} files could not be read and were not imported.")
+
+
+def process_directory(input_dir, conn, jobs=1, batch_size=5000, index_path=None):
+    """
+    Recursively import all .tab files in the given directory, skipping
+    files already imported unchanged and deleting loci whose source files
+    are gone.
+    """
+    with run_stats.stage("list"):
+        tab_files = find_tab_files(input_dir, index_path)
+    import_files(
+        conn,
+        tab_files,
+        jobs=jobs,
+        batch_size=batch_size,
+        prune_under=input_dir,
+    )
 
 
 def main():
@@ -108,27 +255,48 @@ def main():
         required=True,
         help="Path to the SQLite database file to create/use (e.g. /path/to/locus_data.db)",
     )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes used to parse .tab files (default: 1).",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=5000,
+        help="Number of loci written per transaction when importing a directory (default: 5000).",
+    )
+    parser.add_argument(
+        "--index-path",
+        default=None,
+        help="List .tab files from this header index (see header_index.py), skipping files without a chrom/pos row.",
+    )
+    run_stats.add_arguments(parser)
     args = parser.parse_args()
 
-    conn = create_db(args.db_path)
+    with run_stats.session(args):
+        with run_stats.stage("schema"):
+            conn = create_db(args.db_path)
 
-    if os.path.isfile(args.input_path):
-        result = process_file(args.input_path)
-        if result:
+        if os.path.isfile(args.input_path):
             # Use file basename (without extension) as phenotype.
             phenotype = os.path.splitext(os.path.basename(args.input_path))[0]
-            insert_locus_data(
-                conn, phenotype, result["chrom"], result["pos"], result["data"]
+            import_files(conn, [(args.input_path, phenotype)])
+        elif os.path.isdir(args.input_path):
+            process_directory(
+                args.input_path,
+                conn,
+                jobs=args.jobs,
+                batch_size=args.batch_size,
+                index_path=args.index_path,
             )
-            print(f"Inserted data from {args.input_path} under phenotype '{phenotype}'")
-    elif os.path.isdir(args.input_path):
-        process_directory(args.input_path, conn)
-    else:
-        print(
-            f"[ERROR] The input path {args.input_path} does not exist or is not accessible."
-        )
-
-    conn.close()
+        else:
+            print(
+                f"[ERROR] The input path {args.input_path} does not exist or is not accessible."
+            )
+
+        conn.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import locus_db
+from allele_filter import filter_allele_dicts_batch
+from plotly_rewrite import (
+    DEFAULT_COUNT_THRESHOLD,
+    generate_figure_plotly,
+    series_from_dicts,
+)
+
+# Loci read, rendered and written per transaction.
+CHUNK_SIZE = 500
+
+
+def materialize_default_plots(conn, rebuild=False, chunk_size=CHUNK_SIZE):
+    """
+    Precompute the filtered, sorted series and the Plotly JSON payload at the
+    default thresholds for every locus, storing them in locus_default_plot.
+    Only loci without a stored plot are computed unless rebuild is set
+    (the importer drops the stored plot of every locus it updates).
+    The pending loci are listed first and then handled chunk_size at a time,
+    each chunk's series read in full before its plots are written, so no
+    read cursor on locus_default_plot is open while it is being modified.
+    Each chunk is filtered in one stacked array pass.
+    Returns the number of loci materialized.
+    """
+    count = 0
+    with locus_db.bulk_load(conn):
+        with conn:
+            if rebuild:
+                conn.execute("DELETE FROM locus_default_plot")
+        pending = [
+            r[0]
+            for r in conn.execute(
+                "SELECT id FROM locus_data WHERE id NOT IN (SELECT locus_id FROM locus_default_plot) ORDER BY id"
+            )
+        ]
+        for i in range(0, len(pending), chunk_size):
+            series = list(locus_db.iter_allele_series(conn, locus_ids=pending[i : i + chunk_size]))
+            filtered = filter_allele_dicts_batch(
+                [dicts for _, *dicts in series], count_threshold=DEFAULT_COUNT_THRESHOLD
+            )
+            rows = []
+            for (locus, *_), (dosage_dict, mean_dict, ci_dict) in zip(series, filtered):
+                fig = generate_figure_plotly(dosage_dict, mean_dict, ci_dict)
+                rows.append(
+                    (
+                        locus["id"],
+                        DEFAULT_COUNT_THRESHOLD,
+                        json.dumps(series_from_dicts(dosage_dict, mean_dict, ci_dict)),
+                        fig.to_json() if fig is not None else None,
+                    )
+                )
+            with conn:
+                conn.executemany(
+                    """
+                    INSERT INTO locus_default_plot (locus_id, count_threshold, series_json, plot_json)
+                    VALUES (?, ?, ?, ?)
+                """,
+                    rows,
+                )
+            count += len(rows)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompute default-threshold plots into locus_data.db"
+    )
+    parser.add_argument(
+        "--db-path", required=True, help="Path to the SQLite database file."
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        default=False,
+        help="Recompute every locus instead of only those without a stored plot.",
+    )
+    args = parser.parse_args()
+
+    conn = locus_db.connect(args.db_path)
+    locus_db.upgrade_db(conn)
+    start = time.perf_counter()
+    count = materialize_default_plots(conn, rebuild=args.rebuild)
+    conn.close()
+    print(f"Materialized {count} default plots in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,15 @@
 #!/usr/bin/env python3
 import argparse
 import ast
+import io
+import itertools
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 import polars as pl
+import matplotlib
+
+matplotlib.use("Agg")  # Figures are only ever saved, never shown.
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 from matplotlib.ticker import MultipleLocator, MaxNLocator
@@ -10,6 +17,11 @@ import numpy as np
 import math
 import shutil
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import locus_db
+import run_stats
+from allele_filter import filter_allele_dicts
+
 
 def parse_float_or_nan(x):
     """
@@ -37,52 +49,18 @@ def filter_allele_data(
     """
     Filter allele data based on a sample count threshold and optionally
     on confidence interval (CI) criteria.
+    The masks are evaluated as array operations by allele_filter.
     """
-    filtered_dosage = {}
-    filtered_mean = {}
-    filtered_ci = {}
-
-    for allele in dosage_dict.keys():
-        # Check count threshold first.
-        count_val = parse_float_or_nan(dosage_dict[allele])
-        if count_val < count_threshold:
-            continue
-
-        # Parse CI values and mean.
-        try:
-            lower = parse_float_or_nan(ci_dict[allele][0])
-            upper = parse_float_or_nan(ci_dict[allele][1])
-        except (IndexError, TypeError, ValueError):
-            continue
-
-        mean_val = parse_float_or_nan(mean_dict[allele])
-
-        # Exclude data with NaNs.
-        if np.isnan(lower) or np.isnan(upper) or np.isnan(mean_val):
-            continue
-
-        # Optionally, apply CI bounds filtering.
-        if lower_threshold is not None and lower < lower_threshold:
-            continue
-        if upper_threshold is not None and upper > upper_threshold:
-            continue
-
-        # Optionally, filter out alleles with too wide an absolute CI.
-        if max_ci_range is not None and (upper - lower) > max_ci_range:
-            continue
-
-        # Optionally, filter out alleles with too wide a CI relative to the mean.
-        if max_relative_ci_range is not None:
-            relative_ci = (upper - lower) / mean_val
-            if relative_ci > max_relative_ci_range:
-                continue
-
-        # If all checks pass, keep the allele.
-        filtered_dosage[allele] = dosage_dict[allele]
-        filtered_mean[allele] = mean_dict[allele]
-        filtered_ci[allele] = ci_dict[allele]
-
-    return filtered_dosage, filtered_mean, filtered_ci
+    return filter_allele_dicts(
+        dosage_dict,
+        mean_dict,
+        ci_dict,
+        count_threshold=count_threshold,
+        lower_threshold=lower_threshold,
+        upper_threshold=upper_threshold,
+        max_ci_range=max_ci_range,
+        max_relative_ci_range=max_relative_ci_range,
+    )
 
 
 def generate_figure_matplotlib(
@@ -96,14 +74,23 @@ def generate_figure_matplotlib(
     user_x_max=None,
     user_y_min=None,
     user_y_max=None,
+    fig_ax=None,
 ):
+    """
+    Draw the allele plot. Pass an existing (fig, ax) as fig_ax to clear and
+    redraw into it instead of creating a new figure.
+    """
     # Set up the y-axis label.
     y_axis_label = phenotype.replace("_", " ")
     if unit:
         y_axis_label += f" ({unit})"
     y_axis_label = y_axis_label[0].upper() + y_axis_label[1:]
 
-    fig, ax = plt.subplots(figsize=(10, 8))
+    if fig_ax is None:
+        fig, ax = plt.subplots(figsize=(10, 8))
+    else:
+        fig, ax = fig_ax
+        ax.cla()
 
     # Sort alleles numerically.
     sorted_alleles_str = sorted(dosage_dict.keys(), key=float)
@@ -168,22 +155,68 @@ def generate_figure_matplotlib(
     return fig, ax
 
 
-def process_files(file_paths, phenotype, args):
-    output_phenotype_dir = os.path.join(args.output_dir, phenotype)
-    os.makedirs(output_phenotype_dir, exist_ok=True)
-    file_counter = 0
+# Figure reused by every render in this process (one per pool worker).
+_figure_template = None
 
-    for filepath in file_paths:
-        try:
-            df = pl.read_csv(filepath, separator="\t")
-        except Exception as e:
-            print(f"[ERROR] Could not read {filepath}: {e}")
-            continue
 
-        if df.shape[0] != 1:
-            print(f"[WARNING] Found {df.shape[0]} rows in {filepath}, skipping...")
-            continue
+def _get_figure_template():
+    global _figure_template
+    if _figure_template is None:
+        _figure_template = plt.subplots(figsize=(10, 8))
+    return _figure_template
+
+
+def render_allele_plot(dosage_dict, mean_dict, ci_dict, phenotype, args):
+    """
+    Filter one locus's allele data and render its plot to PNG bytes.
+    """
+    # Filter allele data.
+    dosage_dict, mean_dict, ci_dict = filter_allele_data(
+        dosage_dict,
+        mean_dict,
+        ci_dict,
+        count_threshold=args.count_threshold,
+        lower_threshold=None,  # or set a value
+        upper_threshold=None,  # or set a value
+        max_ci_range=args.max_ci_range,
+        max_relative_ci_range=args.max_relative_ci_range,
+    )
+
+    # Generate the figure.
+    fig, ax = generate_figure_matplotlib(
+        dosage_dict,
+        mean_dict,
+        ci_dict,
+        phenotype,
+        unit=args.unit,
+        bw=args.bw,
+        user_x_min=args.x_min,
+        user_x_max=args.x_max,
+        user_y_min=args.y_min,
+        user_y_max=args.y_max,
+        fig_ax=_get_figure_template(),
+    )
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def render_locus_file(filepath, phenotype, args):
+    """
+    Read one .tab file, filter its alleles and render the plot to PNG bytes.
+    Returns (chrom, pos, png_bytes) on success, or (None, None, message)
+    if the file was skipped or failed.
+    """
+    try:
+        df = pl.read_csv(filepath, separator="\t")
+    except Exception as e:
+        return None, None, f"[ERROR] Could not read {filepath}: {e}"
 
+    if df.shape[0] != 1:
+        return None, None, f"[WARNING] Found {df.shape[0]} rows in {filepath}, skipping..."
+
+    try:
         row = df.to_dicts()[0]
         chrom = row["chrom"]
         pos = row["pos"]
@@ -192,57 +225,126 @@ def process_files(file_paths, phenotype, args):
         dosage_dict = ast.literal_eval(row[args.total_column_name])
         candidate_mean_cols = [c for c in row.keys() if c.startswith("mean_")]
         if len(candidate_mean_cols) != 1:
-            print(
-                f"[WARNING] Could not find exactly 1 column starting with 'mean_' in {filepath}, skipping..."
+            return (
+                None,
+                None,
+                f"[WARNING] Could not find exactly 1 column starting with 'mean_' in {filepath}, skipping...",
             )
-            continue
         mean_col_name = candidate_mean_cols[0]
         mean_dict = ast.literal_eval(row[mean_col_name])
         ci_dict = ast.literal_eval(row["summed_length_0.05_alpha_CI"])
 
-        # Filter allele data.
-        dosage_dict, mean_dict, ci_dict = filter_allele_data(
-            dosage_dict,
-            mean_dict,
-            ci_dict,
-            count_threshold=args.count_threshold,
-            lower_threshold=None,  # or set a value
-            upper_threshold=None,  # or set a value
-            max_ci_range=args.max_ci_range,
-            max_relative_ci_range=args.max_relative_ci_range,
-        )
+        return chrom, pos, render_allele_plot(dosage_dict, mean_dict, ci_dict, phenotype, args)
+    except Exception as e:
+        return None, None, f"[ERROR] Could not plot {filepath}: {e}"
 
-        # Generate the figure.
-        fig, ax = generate_figure_matplotlib(
-            dosage_dict,
-            mean_dict,
-            ci_dict,
-            phenotype,
-            unit=args.unit,
-            bw=args.bw,
-            user_x_min=args.x_min,
-            user_x_max=args.x_max,
-            user_y_min=args.y_min,
-            user_y_max=args.y_max,
-        )
+
+def _render_task(task):
+    return render_locus_file(*task)
+
+
+def _render_series_task(task):
+    locus, dosage_dict, mean_dict, ci_dict, args = task
+    try:
+        png = render_allele_plot(dosage_dict, mean_dict, ci_dict, locus["phenotype"], args)
+    except Exception as e:
+        return locus, f"[ERROR] Could not plot locus {locus['id']}: {e}"
+    return locus, png
+
+
+def process_files(file_paths, phenotype, args, pool=None):
+    """
+    Render every file in file_paths. With a process pool the files are
+    rendered in parallel; results are still written in input order, so
+    output filenames match a serial run. A failed file is reported and
+    does not stop the batch.
+    """
+    output_phenotype_dir = os.path.join(args.output_dir, phenotype)
+    os.makedirs(output_phenotype_dir, exist_ok=True)
+    file_counter = 0
+
+    tasks = [(filepath, phenotype, args) for filepath in file_paths]
+    if pool is not None:
+        results = pool.map(_render_task, tasks)
+    else:
+        results = map(_render_task, tasks)
+
+    # "render" is read + filter + draw, or the wait for it with a pool.
+    for filepath, (chrom, pos, payload) in zip(file_paths, run_stats.timed("render", results)):
+        run_stats.count_file(os.path.getsize(filepath))
+        if chrom is None:
+            print(payload)
+            continue
 
         # Construct output filename: {phenotype}_{chrom}_{pos}_{i}.png
         output_fname = f"{phenotype}_{chrom}_{pos}_{file_counter}.png"
         output_path = os.path.join(output_phenotype_dir, output_fname)
-        fig.savefig(output_path)
+        with run_stats.stage("write"), open(output_path, "wb") as f:
+            f.write(payload)
         print(f"Saved plot to {output_path}")
-        plt.close(fig)
 
         file_counter += 1
 
 
+def process_db(db_path, args, pool=None, chunk_size=256):
+    """
+    Render plots for the loci selected by --phenotype / --repeat-ids /
+    --chrom/--start/--end, streaming them from locus_data.db in one
+    sequential read. Output goes to {output-dir}/{phenotype} with the same
+    {phenotype}_{chrom}_{pos}_{i}.png names as the .tab file mode.
+    """
+    conn = locus_db.connect_readonly(db_path)
+    series = locus_db.iter_allele_series(
+        conn,
+        phenotype=args.phenotype,
+        repeat_ids=args.repeat_ids.split(",") if args.repeat_ids else None,
+        chrom=args.chrom,
+        start=args.start,
+        end=args.end,
+    )
+    file_counters = {}
+
+    while True:
+        with run_stats.stage("query"):
+            tasks = [(*item, args) for item in itertools.islice(series, chunk_size)]
+        if not tasks:
+            break
+        if pool is not None:
+            results = pool.map(_render_series_task, tasks)
+        else:
+            results = map(_render_series_task, tasks)
+
+        for locus, payload in run_stats.timed("render", results):
+            run_stats.count_file()
+            if isinstance(payload, str):
+                print(payload)
+                continue
+            phenotype = locus["phenotype"]
+            output_phenotype_dir = os.path.join(args.output_dir, phenotype)
+            if phenotype not in file_counters:
+                os.makedirs(output_phenotype_dir, exist_ok=True)
+                file_counters[phenotype] = 0
+            output_fname = f"{phenotype}_{locus['chrom']}_{locus['pos']}_{file_counters[phenotype]}.png"
+            output_path = os.path.join(output_phenotype_dir, output_fname)
+            with run_stats.stage("write"), open(output_path, "wb") as f:
+                f.write(payload)
+            print(f"Saved plot to {output_path}")
+            file_counters[phenotype] += 1
+
+    conn.close()
+
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument(
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
         "--input-path",
-        required=True,
         help="Path to a file or directory containing .tab files. If a directory, can be flat or contain phenotype subdirectories.",
     )
+    source.add_argument(
+        "--db-path",
+        help="Render from this locus_data.db instead of .tab files (select loci with --phenotype, --repeat-ids, --chrom/--start/--end).",
+    )
     parser.add_argument(
         "--output-dir",
         required=True,
@@ -250,8 +352,8 @@ def main():
     )
     parser.add_argument(
         "--total-column-name",
-        required=True,
-        help="Column holding a JSON dict of sample counts (e.g. sample_count_per_summed_length)",
+        default=None,
+        help="Column holding a JSON dict of sample counts (e.g. sample_count_per_summed_length). Required with --input-path.",
     )
     parser.add_argument(
         "--unit", default=None, help="Optional y-axis unit label (e.g., 10^9 cells/L)"
@@ -294,7 +396,49 @@ def main():
         "--y-max", type=float, default=None, help="Manual top limit for y-axis"
     )
 
+    # Locus selection for --db-path.
+    parser.add_argument(
+        "--phenotype", default=None, help="With --db-path: only plot this phenotype"
+    )
+    parser.add_argument(
+        "--repeat-ids",
+        default=None,
+        help="With --db-path: comma-separated repeat_ids to plot",
+    )
+    parser.add_argument(
+        "--chrom", default=None, help="With --db-path: only plot loci on this chromosome (e.g. chr11)"
+    )
+    parser.add_argument(
+        "--start", type=int, default=None, help="With --db-path: minimum locus position"
+    )
+    parser.add_argument(
+        "--end", type=int, default=None, help="With --db-path: maximum locus position"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes used to render plots (default: 1).",
+    )
+    run_stats.add_arguments(parser)
+
     args = parser.parse_args()
+    if args.input_path and not args.total_column_name:
+        parser.error("--total-column-name is required with --input-path")
+
+    with run_stats.session(args):
+        pool = ProcessPoolExecutor(max_workers=args.jobs) if args.jobs > 1 else None
+        try:
+            run(args, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+
+def run(args, pool=None):
+    if args.db_path:
+        process_db(args.db_path, args, pool)
+        return
 
     input_path = args.input_path
     files_to_process = []
@@ -304,7 +448,7 @@ def main():
         files_to_process = [input_path]
         # Use file basename as phenotype
         phenotype = os.path.splitext(os.path.basename(input_path))[0]
-        process_files(files_to_process, phenotype, args)
+        process_files(files_to_process, phenotype, args, pool)
     elif os.path.isdir(input_path):
         # Check if the directory has subdirectories
         subdirs = [
@@ -323,7 +467,7 @@ def main():
                     if f.endswith(".tab")
                 ]
                 if files:
-                    process_files(files, subdir, args)
+                    process_files(files, subdir, args, pool)
                 else:
                     print(f"[INFO] No .tab files found in {subdir_path}")
         else:
@@ -336,7 +480,7 @@ def main():
             # Use the directory name as the phenotype.
             phenotype = os.path.basename(os.path.normpath(input_path))
             if files:
-                process_files(files, phenotype, args)
+                process_files(files, phenotype, args, pool)
             else:
                 print(f"[INFO] No .tab files found in {input_path}")
     else:
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import locus_db
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="List the strongest loci (smallest p-value) for each phenotype in locus_data.db"
+    )
+    parser.add_argument(
+        "--db-path", required=True, help="Path to the SQLite database file."
+    )
+    parser.add_argument(
+        "--k",
+        type=int,
+        default=10,
+        help="Number of loci per phenotype (default: 10).",
+    )
+    parser.add_argument(
+        "--phenotype",
+        action="append",
+        default=None,
+        help="Phenotype to report; repeat for several (default: every phenotype).",
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Write the table to this TSV file instead of stdout.",
+    )
+    args = parser.parse_args()
+
+    conn = locus_db.connect_readonly(args.db_path)
+    hits = locus_db.top_hits(conn, args.k, args.phenotype)
+    conn.close()
+
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    writer = csv.writer(out, delimiter="\t", lineterminator="\n")
+    writer.writerow(["phenotype", "rank", "chrom", "pos", "repeat_id", "p_value", "coeff", "se"])
+    for phenotype, loci in hits.items():
+        if not loci:
+            print(f"[WARNING] No loci with a p-value for phenotype: {phenotype}", file=sys.stderr)
+        for rank, locus in enumerate(loci, start=1):
+            writer.writerow(
+                [phenotype, rank, locus["chrom"], locus["pos"], locus["repeat_id"],
+                 locus["p_value"], locus["coeff"], locus["se"]]
+            )
+    if args.output:
+        out.close()
+        print(f"Saved top {args.k} loci for {len(hits)} phenotypes to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Production entry point for the GWAS plot app in flask_test.py.
+
+Runs the app under gunicorn with --workers processes of --threads threads
+each when gunicorn is installed. Otherwise it falls back to werkzeug's
+server: threaded with one worker, or forking with several.
+"""
+import argparse
+import os
+
+from flask_test import create_app
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+
+def default_workers():
+    return (os.cpu_count() or 1) * 2 + 1
+
+
+if BaseApplication is not None:
+
+    class GunicornApp(BaseApplication):
+        def __init__(self, app, options):
+            self.application = app
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the GWAS plot app with multiple workers")
+    parser.add_argument("--db-path", default=None, help="Path to the SQLite database file (default: LOCUS_DB_PATH or flask_test.DB_PATH).")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to bind (default: 127.0.0.1).")
+    parser.add_argument("--port", type=int, default=8000, help="Port to bind (default: 8000).")
+    parser.add_argument("--workers", type=int, default=default_workers(), help="Worker processes (default: 2 * CPUs + 1).")
+    parser.add_argument("--threads", type=int, default=8, help="Request threads per worker (default: 8).")
+    parser.add_argument(
+        "--db-workers",
+        type=int,
+        default=None,
+        help="Requests per worker allowed to query SQLite and build figures at once (default: LOCUS_DB_WORKERS or 8).",
+    )
+    parser.add_argument("--timeout", type=int, default=60, help="Seconds before a stuck gunicorn worker is restarted (default: 60).")
+    args = parser.parse_args()
+
+    app = create_app(args.db_path, args.db_workers)
+
+    if BaseApplication is not None:
+        GunicornApp(
+            app,
+            {
+                "bind": f"{args.host}:{args.port}",
+                "workers": args.workers,
+                "threads": args.threads,
+                "worker_class": "gthread",
+                "timeout": args.timeout,
+            },
+        ).run()
+        return
+
+    from werkzeug.serving import run_simple
+
+    print("[WARNING] gunicorn is not installed; falling back to werkzeug's server.")
+    if args.workers > 1:
+        run_simple(args.host, args.port, app, processes=args.workers)
+    else:
+        run_simple(args.host, args.port, app, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
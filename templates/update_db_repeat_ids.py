@@ -1,3 +1,4 @@
+import argparse
 import sqlite3
 import csv
 
@@ -5,46 +6,155 @@ import csv
 DB_PATH = "/Users/ciarareeve/senior_design/BENG187/locus_data.db"
 CSV_FILE = "output_repeat_ids.csv"
 
-# Connect to the database
-conn = sqlite3.connect(DB_PATH)
-cur = conn.cursor()
+UNLABELLED = "(repeat_id IS NULL OR repeat_id = '')"
+
+
+def load_repeat_id_map(csv_file):
+    """Load repeat_id mappings from CSV into a {(chrom, start): repeat_id} dictionary."""
+    repeat_id_map = {}
+    with open(csv_file, "r") as f:
+        reader = csv.reader(f)
+        header = next(reader)  # Skip header
+        for row in reader:
+            repeat_id, chrom, start, _ = row  # Ignore 'end' column
+            formatted_chrom = f"chr{chrom}"  # Ensure it matches DB format
+            try:
+                repeat_id_map[(formatted_chrom, int(start))] = repeat_id
+            except ValueError:
+                print(f"Skipping invalid row: {row}")  # Handle bad data
+    return repeat_id_map
+
+
+def update_row_by_row(cur, repeat_id_map):
+    """Update database with repeat_id where chrom and pos match, one UPDATE per row."""
+    updated_count = 0
+    cur.execute(f"SELECT id, chrom, pos FROM locus_data WHERE {UNLABELLED}")
+    rows = cur.fetchall()
+
+    for row in rows:
+        db_id, db_chrom, db_pos = row
+        key = (db_chrom, db_pos)
+
+        if key in repeat_id_map:
+            repeat_id = repeat_id_map[key]
+            cur.execute("UPDATE locus_data SET repeat_id = ? WHERE id = ?", (repeat_id, db_id))
+            updated_count += 1
+    return updated_count
+
+
+def load_mapping_table(cur, mappings):
+    """
+    Load (chrom, pos, repeat_id) rows from any iterable into the temp table
+    repeat_id_map, keyed on (chrom, pos); a later row for the same
+    coordinates replaces an earlier one, as in load_repeat_id_map().
+    """
+    cur.execute("DROP TABLE IF EXISTS temp.repeat_id_map;")
+    cur.execute(
+        """
+        CREATE TEMP TABLE repeat_id_map (
+            chrom TEXT,
+            pos INTEGER,
+            repeat_id TEXT,
+            PRIMARY KEY (chrom, pos)
+        ) WITHOUT ROWID;
+    """
+    )
+    cur.executemany(
+        "INSERT OR REPLACE INTO repeat_id_map (chrom, pos, repeat_id) VALUES (?, ?, ?)",
+        mappings,
+    )
+
+
+def apply_mapping_table(cur, tolerance=0):
+    """
+    Label every unlabelled row from repeat_id_map in a single UPDATE ... FROM
+    join (SQLite >= 3.33), then drop the temp table. With tolerance > 0,
+    each row takes the nearest mapped start within tolerance bp on the same
+    chromosome (the lower start on a tie), found by an interval join that
+    range-probes the temp table's sorted primary key.
+    """
+    if tolerance <= 0:
+        cur.execute(
+            f"""
+            UPDATE locus_data SET repeat_id = m.repeat_id
+            FROM repeat_id_map m
+            WHERE m.chrom = locus_data.chrom AND m.pos = locus_data.pos
+              AND {UNLABELLED.replace("repeat_id", "locus_data.repeat_id")}
+        """
+        )
+    else:
+        cur.execute(
+            f"""
+            UPDATE locus_data SET repeat_id = nearest.repeat_id
+            FROM (
+                SELECT l.id, m.repeat_id,
+                       ROW_NUMBER() OVER (PARTITION BY l.id ORDER BY abs(m.pos - l.pos), m.pos) AS rank
+                FROM locus_data l
+                JOIN repeat_id_map m
+                  ON m.chrom = l.chrom AND m.pos BETWEEN l.pos - :tolerance AND l.pos + :tolerance
+                WHERE {UNLABELLED.replace("repeat_id", "l.repeat_id")}
+            ) AS nearest
+            WHERE locus_data.id = nearest.id AND nearest.rank = 1
+        """,
+            {"tolerance": tolerance},
+        )
+    updated_count = cur.rowcount
+    cur.execute("DROP TABLE temp.repeat_id_map;")
+    return updated_count
+
+
+def update_bulk(cur, repeat_id_map, tolerance=0):
+    """Set-based update: load the mapping into a temp table and apply it in one statement."""
+    load_mapping_table(cur, ((chrom, pos, repeat_id) for (chrom, pos), repeat_id in repeat_id_map.items()))
+    return apply_mapping_table(cur, tolerance)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fill in locus_data.repeat_id from a (repeat_id, chrom, start, end) CSV"
+    )
+    parser.add_argument("--db-path", default=DB_PATH, help="Path to the SQLite database file.")
+    parser.add_argument("--csv-file", default=CSV_FILE, help="CSV of repeat_id, chrom, start, end.")
+    parser.add_argument(
+        "--mode",
+        choices=["bulk", "row"],
+        default="bulk",
+        help="bulk: one set-based UPDATE join (default); row: one UPDATE per matching row.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=int,
+        default=0,
+        help="Bulk mode only: match the nearest start within this many bp (default: 0, exact).",
+    )
+    args = parser.parse_args()
+
+    # Connect to the database
+    conn = sqlite3.connect(args.db_path)
+    cur = conn.cursor()
+
+    # Ensure the repeat_id column exists
+    cur.execute("PRAGMA table_info(locus_data);")
+    columns = [col[1] for col in cur.fetchall()]
+    if "repeat_id" not in columns:
+        cur.execute("ALTER TABLE locus_data ADD COLUMN repeat_id TEXT;")
+        conn.commit()
+        print("✅ Added 'repeat_id' column to locus_data.")
+
+    repeat_id_map = load_repeat_id_map(args.csv_file)
+
+    if args.mode == "row":
+        if args.tolerance:
+            print("[WARNING] --tolerance only applies to --mode bulk; matching exactly.")
+        updated_count = update_row_by_row(cur, repeat_id_map)
+    else:
+        updated_count = update_bulk(cur, repeat_id_map, args.tolerance)
 
-# Ensure the repeat_id column exists
-cur.execute("PRAGMA table_info(locus_data);")
-columns = [col[1] for col in cur.fetchall()]
-if "repeat_id" not in columns:
-    cur.execute("ALTER TABLE locus_data ADD COLUMN repeat_id TEXT;")
     conn.commit()
-    print("✅ Added 'repeat_id' column to locus_data.")
-
-# Load repeat_id mappings from CSV into a dictionary
-repeat_id_map = {}
-with open(CSV_FILE, "r") as f:
-    reader = csv.reader(f)
-    header = next(reader)  # Skip header
-    for row in reader:
-        repeat_id, chrom, start, _ = row  # Ignore 'end' column
-        formatted_chrom = f"chr{chrom}"  # Ensure it matches DB format
-        try:
-            repeat_id_map[(formatted_chrom, int(start))] = repeat_id
-        except ValueError:
-            print(f"Skipping invalid row: {row}")  # Handle bad data
-
-# Update database with repeat_id where chrom and pos match
-updated_count = 0
-cur.execute("SELECT id, chrom, pos FROM locus_data WHERE repeat_id IS NULL OR repeat_id = ''")
-rows = cur.fetchall()
-
-for row in rows:
-    db_id, db_chrom, db_pos = row
-    key = (db_chrom, db_pos)
-
-    if key in repeat_id_map:
-        repeat_id = repeat_id_map[key]
-        cur.execute("UPDATE locus_data SET repeat_id = ? WHERE id = ?", (repeat_id, db_id))
-        updated_count += 1
-
-conn.commit()
-conn.close()
-
-print(f"✅ Updated {updated_count} entries with repeat_id.")
+    conn.close()
+
+    print(f"✅ Updated {updated_count} entries with repeat_id.")
+
+
+if __name__ == "__main__":
+    main()
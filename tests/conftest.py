@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "scripts"), os.path.join(ROOT, "templates")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import benchmark
+import import_to_db
+
+
+@pytest.fixture
+def tab_dir(tmp_path):
+    """A {phenotype}/locus_N.tab directory of 20 synthetic loci."""
+    out_dir = tmp_path / "tabs"
+    benchmark.generate_tab_files(str(out_dir), 20, seed=1)
+    return out_dir
+
+
+@pytest.fixture
+def imported_db(tmp_path, tab_dir):
+    """tab_dir imported into a fresh locus_data.db; yields the open connection."""
+    conn = import_to_db.create_db(str(tmp_path / "locus_data.db"))
+    import_to_db.process_directory(str(tab_dir), conn)
+    yield conn
+    conn.close()
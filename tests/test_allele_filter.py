@@ -0,0 +1,24 @@
+import pytest
+
+import locus_db
+from allele_filter import filter_allele_dicts, filter_allele_dicts_batch
+
+THRESHOLDS = [
+    {"count_threshold": 100},
+    {"count_threshold": 1000, "max_ci_range": 0.5},
+    {"count_threshold": 0, "max_relative_ci_range": 0.01, "lower_threshold": 10},
+]
+
+
+@pytest.mark.parametrize("thresholds", THRESHOLDS)
+def test_batch_matches_per_locus(imported_db, thresholds):
+    loci = [dicts for _, *dicts in locus_db.iter_allele_series(imported_db)]
+    expected = [filter_allele_dicts(*locus, **thresholds) for locus in loci]
+    assert filter_allele_dicts_batch(loci, **thresholds) == expected
+
+
+def test_batch_handles_empty_and_ragged_input():
+    assert filter_allele_dicts_batch([]) == []
+    short = ({"20.0": 500}, {"20.0": 1.0}, {"20.0": [0.9, 1.1]})
+    empty = ({}, {}, {})
+    assert filter_allele_dicts_batch([short, empty]) == [short, empty]
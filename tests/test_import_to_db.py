@@ -0,0 +1,77 @@
+import csv
+import os
+
+import import_to_db
+
+
+def rewrite_pos(path, new_pos):
+    rewrite_field(path, "pos", new_pos)
+
+
+def rewrite_field(path, column, value):
+    with open(path, newline="") as f:
+        header, row = list(csv.reader(f, delimiter="\t"))
+    row[header.index(column)] = str(value)
+    with open(path, "w", newline="") as f:
+        csv.writer(f, delimiter="\t", lineterminator="\n").writerows([header, row])
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def count(conn, sql):
+    return conn.execute(sql).fetchone()[0]
+
+
+def test_moved_locus_replaces_old_row(imported_db, tab_dir):
+    n_loci = count(imported_db, "SELECT COUNT(*) FROM locus_data")
+    path = next(tab_dir.glob("*/locus_0.tab"))
+    rewrite_pos(path, 999)
+
+    import_to_db.process_directory(str(tab_dir), imported_db)
+
+    assert count(imported_db, "SELECT COUNT(*) FROM locus_data") == n_loci
+    assert count(imported_db, "SELECT COUNT(*) FROM locus_data WHERE pos = 999") == 1
+    assert (
+        count(
+            imported_db,
+            "SELECT COUNT(*) FROM locus_data WHERE id NOT IN (SELECT locus_id FROM import_manifest)",
+        )
+        == 0
+    )
+    assert (
+        count(
+            imported_db,
+            "SELECT COUNT(*) FROM locus_alleles WHERE locus_id NOT IN (SELECT id FROM locus_data)",
+        )
+        == 0
+    )
+
+
+def test_duplicate_file_in_one_batch(imported_db, tab_dir, tmp_path):
+    n_loci = count(imported_db, "SELECT COUNT(*) FROM locus_data")
+    path = next(tab_dir.glob("*/locus_0.tab"))
+    copy = path.with_name("locus_0_copy.tab")
+    copy.write_bytes(path.read_bytes())
+
+    # Both files are new to a fresh database, so they land in the same batch.
+    conn = import_to_db.create_db(str(tmp_path / "fresh.db"))
+    import_to_db.process_directory(str(tab_dir), conn)
+
+    assert count(conn, "SELECT COUNT(*) FROM locus_data") == n_loci
+    assert count(conn, "SELECT COUNT(DISTINCT locus_id) FROM import_manifest") == n_loci
+    assert count(conn, "SELECT COUNT(*) FROM import_manifest") == n_loci + 1
+    conn.close()
+
+
+def test_bad_files_do_not_abort_import(tab_dir, tmp_path, capsys):
+    files = sorted(tab_dir.glob("*/locus_*.tab"))
+    rewrite_field(files[0], "pos", "NA")
+    rewrite_field(files[1], "allele_frequency", "{broken")
+
+    conn = import_to_db.create_db(str(tmp_path / "fresh.db"))
+    import_to_db.process_directory(str(tab_dir), conn)
+
+    assert count(conn, "SELECT COUNT(*) FROM locus_data") == len(files) - 1
+    assert count(conn, "SELECT COUNT(*) FROM locus_data WHERE pos IS NULL") == 1
+    assert f"[ERROR] Could not import {files[1]}" in capsys.readouterr().out
+    conn.close()
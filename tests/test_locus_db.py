@@ -0,0 +1,45 @@
+import locus_db
+
+
+def test_aliased_full_scan_is_flagged(imported_db, monkeypatch):
+    monkeypatch.setattr(
+        locus_db,
+        "QUERY_PATHS",
+        {"aliased scan": ("SELECT l.id FROM locus_data l WHERE l.motif = ?", ("A",))},
+    )
+    assert locus_db.check_query_plans(imported_db) == [("aliased scan", "SCAN l")]
+
+
+def test_cte_scan_is_not_flagged(imported_db, monkeypatch):
+    monkeypatch.setattr(
+        locus_db, "QUERY_PATHS", {"distinct phenotypes": (locus_db.PHENOTYPES_SQL, ())}
+    )
+    assert locus_db.check_query_plans(imported_db) == []
+
+
+def test_v3_migration_collapses_duplicates_onto_lowest_id(tmp_path, capsys):
+    conn = locus_db.connect(str(tmp_path / "v2.db"))
+    for target in (1, 2):
+        locus_db.MIGRATIONS[target - 1](conn)
+        conn.execute(f"PRAGMA user_version = {target};")
+    rows = [
+        ("height", "chr1", 100, "", 0.5),
+        ("height", "chr1", 100, "STR_1", 0.5),
+        ("height", "chr1", 100, "STR_1", 0.01),
+        ("height", "chr2", 100, None, 0.5),
+    ]
+    conn.executemany(
+        "INSERT INTO locus_data (phenotype, chrom, pos, repeat_id, p_value) VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+    conn.commit()
+
+    locus_db.upgrade_db(conn)
+
+    assert conn.execute("SELECT id, repeat_id FROM locus_data ORDER BY id").fetchall() == [
+        (1, "STR_1"),
+        (4, None),
+    ]
+    out = capsys.readouterr().out
+    assert "Removed 2 duplicate loci while adding the natural key: 2, 3" in out
+    assert "Locus 1 kept over duplicates with different data: 3" in out
@@ -0,0 +1,25 @@
+import import_to_db
+import materialize_plots
+
+
+def stored_plots(conn):
+    return conn.execute(
+        "SELECT locus_id, series_json, plot_json FROM locus_default_plot ORDER BY locus_id"
+    ).fetchall()
+
+
+def test_chunks_match_single_pass(imported_db, tmp_path, tab_dir):
+    n_loci = imported_db.execute("SELECT COUNT(*) FROM locus_data").fetchone()[0]
+    assert materialize_plots.materialize_default_plots(imported_db, chunk_size=3) == n_loci
+    assert materialize_plots.materialize_default_plots(imported_db) == 0
+
+    other = import_to_db.create_db(str(tmp_path / "single.db"))
+    import_to_db.process_directory(str(tab_dir), other)
+    materialize_plots.materialize_default_plots(other, chunk_size=n_loci)
+    assert stored_plots(imported_db) == stored_plots(other)
+    other.close()
+
+
+def test_rebuild_recomputes_every_locus(imported_db):
+    n = materialize_plots.materialize_default_plots(imported_db)
+    assert materialize_plots.materialize_default_plots(imported_db, rebuild=True, chunk_size=7) == n
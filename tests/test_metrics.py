@@ -0,0 +1,30 @@
+import flask_test
+import metrics
+
+
+def observed(endpoint):
+    """(sum, count) of locus_db_queries_per_request for endpoint."""
+    series = metrics.QUERIES_PER_REQUEST._series.get(endpoint)
+    return (series[1], sum(series[0])) if series else (0.0, 0)
+
+
+def test_queries_are_counted_per_request(imported_db, tmp_path):
+    client = flask_test.create_app(db_path=str(tmp_path / "locus_data.db")).test_client()
+    before_sum, before_count = observed("api_region")
+
+    client.get("/api/region?region=chr1:0-300000000")
+    client.get("/api/region?region=chr1:0-300000000")
+
+    # Count and rows on a cache miss, nothing on the cached repeat.
+    assert observed("api_region") == (before_sum + 2, before_count + 2)
+
+
+def test_create_app_returns_independent_apps(tmp_path):
+    first = flask_test.create_app(db_path=str(tmp_path / "a.db"), db_workers=2)
+    second = flask_test.create_app(db_path=str(tmp_path / "b.db"), db_workers=3)
+
+    assert first is not second
+    assert first.config["LOCUS_DB_PATH"] == str(tmp_path / "a.db")
+    assert second.config["LOCUS_DB_PATH"] == str(tmp_path / "b.db")
+    assert first.extensions["locus"] is not second.extensions["locus"]
+    assert flask_test.app.config["LOCUS_DB_PATH"] != first.config["LOCUS_DB_PATH"]
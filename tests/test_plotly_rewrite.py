@@ -0,0 +1,27 @@
+import locus_db
+import materialize_plots
+import plotly_rewrite
+
+
+def test_multi_phenotype_repeat_id_picks_first_phenotype(imported_db, tmp_path):
+    # Share one repeat_id between two loci whose alphabetically first
+    # phenotype was imported later, so insertion order can't pick it by luck.
+    first, other = imported_db.execute(
+        """
+        SELECT a.id, b.id FROM locus_data a JOIN locus_data b
+          ON a.phenotype < b.phenotype AND a.id > b.id
+        LIMIT 1
+    """
+    ).fetchone()
+    with imported_db:
+        imported_db.executemany(
+            "UPDATE locus_data SET repeat_id = 'shared' WHERE id = ?", [(first,), (other,)]
+        )
+    materialize_plots.materialize_default_plots(imported_db)
+    _, *dicts = next(locus_db.iter_allele_series(imported_db, locus_ids=[first]))
+    db_path = str(tmp_path / "locus_data.db")
+
+    assert plotly_rewrite.query_allele_data(db_path, "shared") == tuple(dicts)
+    assert plotly_rewrite.query_default_plot_json(db_path, "shared") == imported_db.execute(
+        "SELECT plot_json FROM locus_default_plot WHERE locus_id = ?", (first,)
+    ).fetchone()[0]
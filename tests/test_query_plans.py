@@ -0,0 +1,5 @@
+import locus_db
+
+
+def test_query_paths_use_indexes(imported_db):
+    assert locus_db.check_query_plans(imported_db) == []
@@ -1,11 +1,13 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import plotly.express as px
 import pandas as pd
 import numpy as np
+import threading
+import time
+from collections import OrderedDict
 import dash
-import dash_core_components as dcc
-import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash import dcc, html, Patch
+from dash.dependencies import Input, Output, State
 
 # Initialize Flask app
 server = Flask(__name__)
@@ -17,6 +19,63 @@ app = dash.Dash(__name__, server=server, url_base_pathname='/dash/')
 LOCUS_ID = "default_locus"
 PHENOTYPE = "default_phenotype"
 
+# Parameters are kept per session. Pages and updates posted without a
+# session_id use DEFAULT_SESSION; a page opened as /dash/?session=<id> follows
+# that session instead. Least recently used sessions are dropped past MAX_SESSIONS.
+DEFAULT_SESSION = "default"
+MAX_SESSIONS = 1024
+# Idle event streams send a comment this often so proxies keep them open.
+SSE_HEARTBEAT_SECONDS = 15
+# A stream with no update for this long is closed to free its server thread;
+# the browser's EventSource reconnects on its own if the page is still open.
+SSE_IDLE_TIMEOUT_SECONDS = 30 * 60
+
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+
+class Session:
+    """One session's parameters. `changed` guards them and wakes only this session's streams."""
+
+    def __init__(self):
+        self.locus_id = LOCUS_ID
+        self.phenotype = PHENOTYPE
+        self.version = 0
+        self.evicted = False
+        self.changed = threading.Condition()
+
+    def snapshot(self):
+        with self.changed:
+            return {"locus_id": self.locus_id, "phenotype": self.phenotype, "version": self.version}
+
+
+def get_session(session_id, create=True):
+    """
+    Return session_id's Session and mark it recently used, creating it if
+    needed. With create=False a missing (or evicted) session returns None.
+    """
+    evicted = []
+    with _sessions_lock:
+        session = _sessions.get(session_id)
+        if session is None:
+            if not create:
+                return None
+            session = _sessions[session_id] = Session()
+            while len(_sessions) > MAX_SESSIONS:
+                evicted.append(_sessions.popitem(last=False)[1])
+        _sessions.move_to_end(session_id)
+    # Wake any streams of dropped sessions so they can close.
+    for old in evicted:
+        with old.changed:
+            old.evicted = True
+            old.changed.notify_all()
+    return session
+
+
+def session_snapshot(session_id):
+    return get_session(session_id).snapshot()
+
+
 # Sample locus data function
 def generate_locus_data(locus_id, phenotype):
     x = np.linspace(-10, 10, 400)
@@ -24,32 +83,148 @@ def generate_locus_data(locus_id, phenotype):
     df = pd.DataFrame({'Position': x, 'Value': y, 'Locus ID': locus_id, 'Phenotype': phenotype})
     return df
 
+
+def plot_title(params):
+    return f'Locus Visualization: {params["locus_id"]} ({params["phenotype"]})'
+
+
+def generate_figure(params):
+    df = generate_locus_data(params["locus_id"], params["phenotype"])
+    return px.line(df, x='Position', y='Value', title=plot_title(params))
+
+
 # Define API endpoint to update Locus ID and Phenotype
 @server.route("/update_params", methods=["POST"])
 def update_params():
-    global LOCUS_ID, PHENOTYPE
     data = request.get_json()
-    LOCUS_ID = data.get("locus_id", LOCUS_ID)
-    PHENOTYPE = data.get("phenotype", PHENOTYPE)
-    return jsonify({"message": "Parameters updated", "locus_id": LOCUS_ID, "phenotype": PHENOTYPE})
+    session_id = data.get("session_id", DEFAULT_SESSION)
+    session = get_session(session_id)
+    with session.changed:
+        locus_id = data.get("locus_id", session.locus_id)
+        phenotype = data.get("phenotype", session.phenotype)
+        # Only a real change wakes the session's open pages.
+        if (locus_id, phenotype) != (session.locus_id, session.phenotype):
+            session.locus_id, session.phenotype = locus_id, phenotype
+            session.version += 1
+            session.changed.notify_all()
+    return jsonify({"message": "Parameters updated", "session_id": session_id, "locus_id": locus_id, "phenotype": phenotype})
+
+
+@server.route("/events/<session_id>")
+def params_events(session_id):
+    """
+    Server-sent events for one session: sends the new parameter version
+    whenever /update_params changes it, and nothing else while idle. The
+    stream ends when the session is evicted or after SSE_IDLE_TIMEOUT_SECONDS
+    without an update; an unknown session gets 204, which tells EventSource
+    not to reconnect.
+    """
+    session = get_session(session_id, create=False)
+    if session is None:
+        return Response(status=204)
+    last_id = request.headers.get("Last-Event-ID") or request.args.get("version")
+    seen = int(last_id) if last_id is not None and last_id.isdigit() else -1
+
+    def stream():
+        nonlocal seen
+        idle_since = time.monotonic()
+        while True:
+            with session.changed:
+                session.changed.wait_for(
+                    lambda: session.version != seen or session.evicted,
+                    timeout=SSE_HEARTBEAT_SECONDS,
+                )
+                version, evicted = session.version, session.evicted
+            if evicted:
+                return
+            if version == seen:
+                if time.monotonic() - idle_since >= SSE_IDLE_TIMEOUT_SECONDS:
+                    return
+                yield ": keepalive\n\n"
+                continue
+            seen = version
+            idle_since = time.monotonic()
+            yield f"id: {version}\ndata: {version}\n\n"
+
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+def serve_layout():
+    """Built per page load, so every page starts with a full figure of DEFAULT_SESSION."""
+    params = session_snapshot(DEFAULT_SESSION)
+    return html.Div([
+        dcc.Location(id='url'),
+        html.H1("Locus Advanced Plot"),
+        html.P(f"Session: {DEFAULT_SESSION}", id='session-label'),
+        dcc.Graph(id='locus-plot', figure=generate_figure(params)),
+        dcc.Store(id='session-id', data=DEFAULT_SESSION),
+        dcc.Store(id='session-params', data={"session_id": DEFAULT_SESSION, "version": params["version"]}),
+        dcc.Store(id='params-version', data=params["version"]),
+        dcc.Store(id='event-source'),
+    ])
+
 
 # Layout for Dash app
-app.layout = html.Div([
-    html.H1("Locus Advanced Plot"),
-    dcc.Graph(id='locus-plot'),
-    dcc.Interval(id='interval-update', interval=2000, n_intervals=0)
-])
+app.layout = serve_layout
+
+# Dash fetches the layout without the page's query string, so ?session= is read here.
+app.clientside_callback(
+    """
+    function(search, current) {
+        var sessionId = new URLSearchParams(search || "").get("session") || "%s";
+        return sessionId === current ? dash_clientside.no_update : sessionId;
+    }
+    """ % DEFAULT_SESSION,
+    Output('session-id', 'data'),
+    Input('url', 'search'),
+    State('session-id', 'data'),
+)
+
+# Open one EventSource per page, once its session is loaded; each pushed
+# version updates params-version.
+app.clientside_callback(
+    """
+    function(loaded) {
+        if (window.locusEvents) {
+            window.locusEvents.close();
+        }
+        var source = new EventSource("/events/" + encodeURIComponent(loaded.session_id) + "?version=" + loaded.version);
+        source.onmessage = function(e) {
+            dash_clientside.set_props("params-version", {data: parseInt(e.data, 10)});
+        };
+        window.locusEvents = source;
+        return true;
+    }
+    """,
+    Output('event-source', 'data'),
+    Input('session-params', 'data'),
+)
 
 # Callback to update plot
 @app.callback(
     Output('locus-plot', 'figure'),
-    Input('interval-update', 'n_intervals')
+    Output('session-label', 'children'),
+    Output('session-params', 'data'),
+    Input('params-version', 'data'),
+    Input('session-id', 'data'),
+    prevent_initial_call=True
 )
-def update_plot(n):
-    df = generate_locus_data(LOCUS_ID, PHENOTYPE)
-    fig = px.line(df, x='Position', y='Value', title=f'Locus Visualization: {LOCUS_ID} ({PHENOTYPE})')
-    return fig
+def update_plot(version, session_id):
+    params = session_snapshot(session_id)
+    if dash.ctx.triggered_id == 'session-id':
+        # The page switched to the session in its URL: send the whole figure.
+        return (
+            generate_figure(params),
+            f"Session: {session_id}",
+            {"session_id": session_id, "version": params["version"]},
+        )
+    # Only the y values and title change with the parameters, so send just those.
+    df = generate_locus_data(params["locus_id"], params["phenotype"])
+    patched = Patch()
+    patched['data'][0]['y'] = df['Value'].tolist()
+    patched['layout']['title']['text'] = plot_title(params)
+    return patched, dash.no_update, dash.no_update
+
 
 if __name__ == "__main__":
     server.run(debug=True)
-